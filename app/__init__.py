@@ -23,10 +23,11 @@ login_manager.login_message = 'Silakan login untuk mengakses halaman ini.'
 
 migrate = Migrate()
 csrf = CSRFProtect()
+from app import ratelimit # noqa: F401 (registers the sqlite:// storage scheme)
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://" # Use in-memory storage
+    # Storage and strategy come from RATELIMIT_STORAGE_URI / RATELIMIT_STRATEGY
 )
 talisman = Talisman() # Initialize Talisman
 
@@ -45,16 +46,27 @@ def create_app(config_class=Config):
 
     db.init_app(app)
     login_manager.init_app(app)
+    from app.sessions import init_sessions
+    init_sessions(app)
     migrate.init_app(app, db)
     csrf.init_app(app)
     limiter.init_app(app)
+    from app.ratelimit import failed_logins
+    failed_logins.init_app(app)
 
     # Register user_loader and import models within app context
     from app.models import User, SuratMasuk, SuratKeluar
+    from app.changes import init_change_tracking
+    init_change_tracking()
     
+    from app.cache import directory_cache, user_cache
+    user_cache.init_app(app, User)
+    directory_cache.init_app(app, User)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # Served from memory for USER_CACHE_TTL seconds; see app.cache.UserCache
+        return user_cache.load(db.session, int(user_id))
 
     # Log email configuration for debugging
     app.logger.debug(f"MAIL_SERVER: {app.config.get('MAIL_SERVER')}")
@@ -113,6 +125,24 @@ def create_app(config_class=Config):
     app.register_blueprint(surat_masuk_bp)
     app.register_blueprint(surat_keluar_bp)
 
+    from app.commands import register_commands
+    register_commands(app)
+
+    from app.queries import init_query_counter, SURAT_MASUK_LIST, SURAT_KELUAR_LIST
+    init_query_counter(app)
+
+    from app.cache import count_cache
+    count_cache.init_app(app, [SURAT_MASUK_LIST, SURAT_KELUAR_LIST])
+
+    from app.storage import init_storage
+    init_storage(app)
+
+    # Job handlers register on import; the worker needs them even when no route imported them
+    from app import previews, extraction # noqa: F401
+    previews.check_renderer(app)
+    from app.jobs import init_jobs
+    init_jobs(app)
+
     from werkzeug.exceptions import RequestEntityTooLarge
     from flask import flash, redirect, request
 
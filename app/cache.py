@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app.changes import on_commit
+from app.utils import LocalSQLite
+
+
+class TTLCache:
+    """Thread-safe in-process cache with a time-to-live and LRU eviction."""
+
+    def __init__(self, maxsize=512, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict() # key -> (value, expires_at)
+        self._lock = threading.RLock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        # compute() runs outside the lock so a slow query does not block other readers
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def update_where(self, predicate, update):
+        """Apply ``update(key, value)`` to every live entry whose key matches
+        ``predicate``. ``update`` returns the new value, or _DROP to evict."""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                value, expires_at = self._data[key]
+                new_value = update(key, value)
+                if new_value is _DROP:
+                    del self._data[key]
+                else:
+                    self._data[key] = (new_value, expires_at)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+_MISSING = object()
+_DROP = object()
+
+
+class CountCache:
+    """Caches the total row count of letter lists per filter signature.
+
+    The signature is (table, owner_id, search term, search_by, start date,
+    end date); owner_id is None for admins, so it also captures the role.
+    Committed inserts and deletes adjust cached counts by one when the row
+    falls inside an entry's owner/date filter; entries with a search term
+    are dropped instead, because their match cannot be decided here.
+
+    The cache is per process. Writes made in other workers only show up
+    once an entry expires, which COUNT_CACHE_TTL bounds.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache()
+        self._specs = {}
+
+    def init_app(self, app, specs):
+        self._cache.configure(app.config.get('COUNT_CACHE_SIZE', 512), app.config.get('COUNT_CACHE_TTL', 300))
+        for spec in specs:
+            if spec.model.__tablename__ in self._specs:
+                continue
+            self._specs[spec.model.__tablename__] = spec
+            on_commit(spec.model, lambda op, values, old_values, spec=spec: self._on_write(spec, op, values, old_values))
+
+    @staticmethod
+    def signature(filters):
+        return (
+            filters.spec.model.__tablename__,
+            filters.owner_id,
+            filters.search_query.lower(),
+            filters.search_by if filters.search_query else None,
+            filters.start_date,
+            filters.end_date,
+        )
+
+    def count(self, filters, query):
+        """Total rows of ``query`` (already filtered by ``filters``)."""
+        return self._cache.get_or_set(self.signature(filters), lambda: query.order_by(None).count())
+
+    def clear(self):
+        self._cache.clear()
+
+    def invalidate(self, model):
+        """Drop every cached count of ``model``'s table (e.g. after bulk inserts)."""
+        table = model.__tablename__
+        self._cache.update_where(lambda key: key[0] == table, lambda key, value: _DROP)
+
+    def stats(self):
+        return self._cache.stats()
+
+    @staticmethod
+    def _matches(spec, key, values):
+        _, owner_id, _, _, start_date, end_date = key
+        if owner_id is not None and values.get('uploaded_by_user_id') != owner_id:
+            return False
+        row_date = values.get(spec.date_field)
+        if start_date and (row_date is None or row_date < start_date):
+            return False
+        if end_date and (row_date is None or row_date > end_date):
+            return False
+        return True
+
+    def _on_write(self, spec, op, values, old_values):
+        table = spec.model.__tablename__
+        if 'uploaded_by_user_id' not in values or spec.date_field not in values:
+            # Not enough of the row was loaded to place it; start over for this table
+            self.invalidate(spec.model)
+            return
+        if op == 'update':
+            relevant = {'uploaded_by_user_id', spec.date_field} & set(old_values)
+            if not relevant:
+                # Owner and date unchanged: only search entries can be affected
+                self._cache.update_where(lambda key: key[0] == table and key[2], lambda key, value: _DROP)
+                return
+            before = dict(values, **old_values)
+
+        def adjust(key, value):
+            if key[2]:
+                return _DROP
+            if op == 'insert':
+                return value + 1 if self._matches(spec, key, values) else value
+            if op == 'delete':
+                return value - 1 if self._matches(spec, key, values) else value
+            return value - self._matches(spec, key, before) + self._matches(spec, key, values)
+
+        self._cache.update_where(lambda key: key[0] == table, adjust)
+
+
+count_cache = CountCache()
+
+_GENERATION_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS user_generations (
+        user_id INTEGER PRIMARY KEY,
+        generation INTEGER NOT NULL
+    )""",
+]
+
+
+class UserCache:
+    """Identity cache for the Flask-Login user loader.
+
+    Holds a snapshot of each user's columns rather than the ORM object, so
+    nothing is shared between sessions; a hit is attached to the request's
+    session with merge(load=False) and costs no database query.
+
+    Every committed change to a User row bumps that user's generation in
+    USER_CACHE_STORE, a local SQLite file shared by the workers of the host.
+    An entry remembers the generation it was loaded at, so a deactivation or
+    a new role made in any worker on the host applies on the next request.
+    Other hosts only catch up when the entry expires after USER_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache()
+        self._registered = False
+        self.generations = None
+
+    def init_app(self, app, model):
+        self.model = model
+        self._cache.configure(app.config.get('USER_CACHE_SIZE', 1024), app.config.get('USER_CACHE_TTL', 30))
+        self.generations = LocalSQLite(app.config['USER_CACHE_STORE'], _GENERATION_SCHEMA)
+        if not self._registered:
+            on_commit(model, lambda op, values, old_values: self.invalidate(values.get('id')))
+            self._registered = True
+
+    def _generation(self, user_id):
+        row = self.generations.connection().execute(
+            'SELECT generation FROM user_generations WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def load(self, session, user_id):
+        # Read before loading, so a change committed in between is not missed
+        generation = self._generation(user_id)
+        entry = self._cache.get(user_id)
+        if entry is None or entry[0] != generation:
+            user = session.get(self.model, user_id)
+            if user is not None:
+                state = inspect(user)
+                self._cache.set(user_id, (generation, {
+                    attr.key: getattr(user, attr.key) for attr in state.mapper.column_attrs
+                }))
+            return user
+        user = self.model(**entry[1])
+        make_transient_to_detached(user)
+        return session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        if user_id is None:
+            self._cache.clear()
+            return
+        self._cache.pop(user_id)
+        with self.generations.write() as connection:
+            connection.execute(
+                'INSERT INTO user_generations (user_id, generation) VALUES (?, 1) '
+                'ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1',
+                (user_id,),
+            )
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+user_cache = UserCache()
+
+
+class DirectoryCache:
+    """Member roster pages and the member total, shared by the member views.
+
+    Keys carry a version number that every committed change to a listed
+    column of a User bumps (registration, approval, edits), so all older
+    entries become unreachable at once and age out of the LRU. Per process
+    like the other caches: other workers catch up within DIRECTORY_CACHE_TTL.
+    """
+
+    FIELDS = {'role', 'nama_lengkap', 'nia', 'jenjang_keanggotaan', 'nama_lapangan', 'is_active'}
+
+    def __init__(self):
+        self._cache = TTLCache()
+        self._lock = threading.Lock()
+        self._registered = False
+        self.version = 0
+
+    def init_app(self, app, model):
+        self._cache.configure(app.config.get('DIRECTORY_CACHE_SIZE', 128), app.config.get('DIRECTORY_CACHE_TTL', 300))
+        if not self._registered:
+            on_commit(model, self._on_write)
+            self._registered = True
+
+    def page(self, cursor, per_page, compute):
+        return self._cache.get_or_set((self.version, 'page', cursor, per_page), compute)
+
+    def total(self, compute):
+        return self._cache.get_or_set((self.version, 'total'), compute)
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        return dict(self._cache.stats(), version=self.version)
+
+    def _on_write(self, op, values, old_values):
+        if op == 'update' and not self.FIELDS & set(old_values):
+            return # e.g. a token reissue or password rehash
+        if values.get('role') == 'admin' and 'role' not in old_values:
+            return
+        self.bump()
+
+
+directory_cache = DirectoryCache()
@@ -0,0 +1,82 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+# Subscribers are called with (op, values, old_values) once the transaction that
+# changed a row has committed. op is 'insert', 'update' or 'delete'; values is a
+# snapshot of the row's columns and old_values holds the previous value of every
+# column the update touched. Rolled-back transactions notify nobody; a rolled
+# back SAVEPOINT only drops the changes flushed inside it.
+_subscribers = {}
+_installed = False
+
+
+def on_commit(model, callback):
+    """Register ``callback`` for committed changes to rows of ``model``."""
+    _subscribers.setdefault(model, []).append(callback)
+
+
+def _snapshot(obj):
+    state = inspect(obj)
+    values = {}
+    old_values = {}
+    for attr in state.mapper.column_attrs:
+        key = attr.key
+        if key in state.unloaded:
+            continue
+        values[key] = getattr(obj, key)
+        history = state.attrs[key].history
+        if history.deleted:
+            old_values[key] = history.deleted[0]
+    return values, old_values
+
+
+def _after_flush(session, flush_context):
+    if not _subscribers:
+        return
+    pending = session.info.setdefault('committed_changes', [])
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            model = type(obj)
+            if model not in _subscribers:
+                continue
+            if op == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            values, old_values = _snapshot(obj)
+            pending.append((transaction, model, op, values, old_values))
+
+
+def _after_commit(session):
+    pending = session.info.pop('committed_changes', None)
+    if not pending:
+        return
+    for _, model, op, values, old_values in pending:
+        for callback in _subscribers.get(model, []):
+            callback(op, values, old_values)
+
+
+def _within(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # Fires for SAVEPOINTs too (e.g. a begin_nested() that hit an
+    # IntegrityError); the enclosing transaction's changes still commit
+    pending = session.info.get('committed_changes')
+    if not pending:
+        return
+    pending[:] = [entry for entry in pending if not _within(entry[0], previous_transaction)]
+
+
+def init_change_tracking():
+    global _installed
+    if _installed:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
+    _installed = True
@@ -0,0 +1,279 @@
+import os
+import click
+from app.queries import SURAT_MASUK_LIST, SURAT_KELUAR_LIST
+
+LIST_SPECS = {
+    'masuk': SURAT_MASUK_LIST,
+    'keluar': SURAT_KELUAR_LIST,
+}
+
+
+def register_commands(app):
+    @app.cli.command('search-reindex')
+    @click.argument('jenis', type=click.Choice(['masuk', 'keluar', 'semua']), default='semua')
+    def search_reindex(jenis):
+        """Rebuild the full-text search index for letters."""
+        from app.search import get_search_backend
+        backend = get_search_backend()
+        specs = LIST_SPECS.values() if jenis == 'semua' else [LIST_SPECS[jenis]]
+        for spec in specs:
+            backend.reindex(spec)
+            click.echo(f'Index {spec.model.__tablename__} dibangun ulang ({backend.name}).')
+        if jenis == 'semua':
+            backend.reindex_content()
+            click.echo(f'Index isi dokumen dibangun ulang ({backend.name}).')
+
+    @app.cli.command('index-advisor')
+    @click.argument('jenis', type=click.Choice(['masuk', 'keluar', 'semua']), default='semua')
+    @click.option('--show-plan', is_flag=True, help='Tampilkan rencana EXPLAIN untuk setiap kombinasi.')
+    @click.option('--strict', is_flag=True, help='Keluar dengan status 1 bila ada full scan.')
+    def index_advisor(jenis, show_plan, strict):
+        """EXPLAIN every filter/search/sort combination of the letter lists and flag full scans."""
+        from app.index_advisor import advise
+        specs = LIST_SPECS.values() if jenis == 'semua' else [LIST_SPECS[jenis]]
+        total = scans = sorts = 0
+        for spec in specs:
+            for report in advise(spec):
+                total += 1
+                problems = []
+                if report.full_scans:
+                    scans += 1
+                    problems.append('FULL SCAN ' + ','.join(report.full_scans))
+                if report.filesort:
+                    sorts += 1
+                    problems.append('FILESORT')
+                status = ' + '.join(problems) or 'OK'
+                click.echo(f'[{status}] {report.label}')
+                if show_plan or report.full_scans:
+                    for line in report.plan:
+                        click.echo(f'    {line}')
+        click.echo(f'{total} kombinasi diperiksa: {scans} full scan, {sorts} perlu sort tambahan.')
+        click.echo('Catatan: sort=perihal selalu perlu sort tambahan karena perihal bertipe TEXT.')
+        click.echo('Catatan: sort=relevansi selalu perlu sort tambahan karena skornya dihitung per pencarian.')
+        if strict and scans:
+            raise SystemExit(1)
+
+    @app.cli.command('import-surat')
+    @click.argument('jenis', type=click.Choice(['masuk', 'keluar']))
+    @click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+    @click.argument('arsip', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--uploader', required=True, help='Username admin yang dicatat sebagai pengunggah.')
+    @click.option('--laporan', type=click.Path(dir_okay=False, writable=True), help='Tulis baris yang ditolak ke file CSV ini.')
+    @click.option('--workers', type=int, default=None, help='Jumlah thread untuk memeriksa dan mengekstrak file.')
+    @click.option('--batch', type=int, default=None, help='Jumlah baris per executemany.')
+    def import_surat(jenis, manifest, arsip, uploader, laporan, workers, batch):
+        """Bulk-import letters from a CSV manifest and a ZIP of scans."""
+        from app.importer import import_letters
+        from app.models import User
+        user = User.query.filter_by(username=uploader, role='admin').first()
+        if user is None:
+            raise click.ClickException(f'Admin dengan username {uploader} tidak ditemukan.')
+        with open(manifest, encoding='utf-8-sig', newline='') as manifest_file:
+            try:
+                report = import_letters(
+                    LIST_SPECS[jenis],
+                    manifest_file,
+                    arsip,
+                    user.id,
+                    workers=workers or app.config.get('IMPORT_WORKERS', 4),
+                    batch_size=batch or app.config.get('IMPORT_BATCH_SIZE', 500),
+                )
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        app.logger.info(f"CLI import by {uploader}: {report.inserted} Surat {jenis.capitalize()} inserted, {len(report.errors)} rows rejected")
+        click.echo(f'{report.inserted} surat diimpor, {len(report.errors)} baris ditolak.')
+        if report.errors:
+            if laporan:
+                with open(laporan, 'w', encoding='utf-8', newline='') as report_file:
+                    report_file.write(report.error_csv())
+                click.echo(f'Laporan kesalahan ditulis ke {laporan}.')
+            else:
+                for line, nomor_surat, message in sorted(report.errors):
+                    click.echo(f'  baris {line} [{nomor_surat}]: {message}')
+
+    @app.cli.command('storage-migrate')
+    @click.argument('jenis', type=click.Choice(['masuk', 'keluar', 'semua']), default='semua')
+    @click.option('--batch', type=int, default=200, help='Jumlah surat per transaksi.')
+    @click.option('--rate', type=float, default=None, help='Batas file per detik agar disk tidak terbebani.')
+    @click.option('--dry-run', is_flag=True, help='Hanya hitung file yang akan dipindahkan.')
+    def storage_migrate(jenis, batch, rate, dry_run):
+        """Move legacy uuid-named uploads into the content-addressed blob store."""
+        from app.storage import migrate_legacy_files
+        from app.routes import surat_masuk, surat_keluar
+        folders = {'masuk': surat_masuk.UPLOAD_FOLDER, 'keluar': surat_keluar.UPLOAD_FOLDER}
+        kinds = ['masuk', 'keluar'] if jenis == 'semua' else [jenis]
+        for kind in kinds:
+            model = LIST_SPECS[kind].model
+            stats = migrate_legacy_files(model, folders[kind], batch_size=batch, dry_run=dry_run, rate=rate)
+            verb = 'akan dipindahkan' if dry_run else 'dipindahkan'
+            click.echo(f"{model.__tablename__}: {stats['migrated']} file {verb}, {stats['deduplicated']} duplikat digabung, {len(stats['missing'])} file hilang.")
+            for surat_id, file_path in stats['missing']:
+                click.echo(f'  ID {surat_id}: {file_path} tidak ditemukan')
+
+    @app.cli.command('storage-reshard')
+    @click.option('--batch', type=int, default=500, help='Jumlah file per laporan kemajuan.')
+    @click.option('--rate', type=float, default=None, help='Batas file per detik agar disk tidak terbebani.')
+    def storage_reshard(batch, rate):
+        """Move flat blob files into the ab/cd/ shard directories (resumable)."""
+        from app.storage import get_blob_store
+        total = 0
+        for handled in get_blob_store().reshard(batch_size=batch, rate=rate):
+            total += handled
+            click.echo(f'{total} file dipindahkan...')
+        click.echo(f'Selesai: {total} file dipindahkan ke direktori shard.')
+
+    @app.cli.command('text-extract')
+    @click.option('--force', is_flag=True, help='Ekstrak ulang meskipun teks sudah ada.')
+    @click.option('--batch', type=int, default=50, help='Jumlah file per transaksi.')
+    def text_extract(force, batch):
+        """Extract searchable text from stored PDF/DOCX files that have none yet."""
+        from sqlalchemy import or_
+        from app import db
+        from app.extraction import EXTRACTABLE_MIME_TYPES, EXTRACTOR_VERSION, extract_blob_text
+        from app.models import Blob, BlobText
+        query = db.session.query(Blob.digest).outerjoin(BlobText).filter(Blob.mime_type.in_(EXTRACTABLE_MIME_TYPES))
+        if not force:
+            query = query.filter(or_(BlobText.id.is_(None), BlobText.extractor_version < EXTRACTOR_VERSION))
+        digests = [digest for digest, in query.order_by(Blob.digest)]
+        for done, digest in enumerate(digests, start=1):
+            extract_blob_text(digest, force=force)
+            if done % batch == 0 or done == len(digests):
+                db.session.commit()
+                click.echo(f'{done}/{len(digests)} file diekstrak...')
+        click.echo(f'Selesai: teks {len(digests)} file diekstrak.')
+
+    @app.cli.command('jobs-worker')
+    @click.option('--workers', type=int, default=None, help='Jumlah thread yang menjalankan tugas.')
+    @click.option('--poll', type=float, default=2.0, help='Jeda dalam detik saat antrian kosong.')
+    @click.option('--once', is_flag=True, help='Berhenti setelah antrian kosong.')
+    def jobs_worker(workers, poll, once):
+        """Run queued background jobs (file removal, previews) until interrupted."""
+        from flask import current_app
+        from app.jobs import VOLUME_MARKER, run_worker
+        app = current_app._get_current_object()
+        workers = workers or app.config.get('JOB_WORKERS', 2)
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], VOLUME_MARKER)):
+            click.echo('Peringatan: UPLOAD_FOLDER ini belum pernah dipakai server web. '
+                       'Worker harus berjalan di host/volume yang sama.')
+        click.echo(f'Worker berjalan dengan {workers} thread.')
+        total = run_worker(app, workers=workers, poll_interval=poll, once=once, log=click.echo)
+        click.echo(f'Selesai: {total} tugas dijalankan.')
+
+    @app.cli.command('password-benchmark')
+    @click.option('--method', 'methods', multiple=True, help='Metode hash yang diuji (boleh berulang), mis. scrypt:16384:8:1.')
+    @click.option('--rounds', type=int, default=20, help='Jumlah pengulangan per metode.')
+    def password_benchmark(methods, rounds):
+        """Time password hashing settings: latency per hash and logins per second per core."""
+        from app.passwords import BENCHMARK_METHODS, benchmark, configured_method
+        current = configured_method()
+        methods = list(methods) or [current] + [method for method in BENCHMARK_METHODS if method != current]
+        click.echo(f"{'metode':<24} {'hash (ms)':>10} {'verifikasi (ms)':>16} {'login/detik/core':>17}")
+        for method in methods:
+            result = benchmark(method, rounds=rounds)
+            marker = ' *' if result['method'] == current else ''
+            click.echo(f"{result['method']:<24} {result['hash_ms']:>10.1f} {result['verify_ms']:>16.1f} {result['logins_per_core']:>17.1f}{marker}")
+        click.echo('* = PASSWORD_HASH_METHOD saat ini')
+
+    @app.cli.command('token-benchmark')
+    @click.option('--rounds', type=int, default=1000, help='Jumlah pengulangan untuk skema HMAC.')
+    def token_benchmark(rounds):
+        """Time one access token check with the legacy KDF hash and with HMAC."""
+        from app.passwords import benchmark_access_token
+        results = benchmark_access_token(rounds=rounds)
+        for name, micros in results.items():
+            click.echo(f'{name:<28} {micros:>12.1f} µs per verifikasi')
+        legacy, current = results.values()
+        click.echo(f'HMAC {legacy / current:.0f}x lebih cepat.')
+
+    @app.cli.command('ratelimit-benchmark')
+    @click.option('--workers', type=int, default=4, help='Jumlah proses paralel maksimum.')
+    @click.option('--checks', type=int, default=2000, help='Jumlah pemeriksaan per proses.')
+    @click.option('--keys', type=int, default=100, help='Jumlah kunci (alamat IP) berbeda.')
+    def ratelimit_benchmark(workers, checks, keys):
+        """Time sliding-window checks on the SQLite rate limit storage with 1, 2, 4 ... concurrent processes."""
+        import shutil
+        import tempfile
+        from app.ratelimit import benchmark
+        # A scratch file, so the real counters are left alone
+        directory = tempfile.mkdtemp(prefix='ratelimit-bench-')
+        try:
+            click.echo(f"{'proses':>6} {'cek/detik':>12} {'p50 (µs)':>10} {'p95 (µs)':>10} {'p99 (µs)':>10}")
+            count = 1
+            while True:
+                result = benchmark(f'sqlite:///{directory}/bench.db', count, checks, keys)
+                click.echo(f"{count:>6} {result['checks_per_second']:>12.0f} {result['p50']:>10.0f} {result['p95']:>10.0f} {result['p99']:>10.0f}")
+                if count >= workers:
+                    break
+                count = min(count * 2, workers)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @app.cli.command('storage-stats')
+    @click.option('--top', type=int, default=0, help='Tampilkan N file dengan penghematan terbesar.')
+    def storage_stats(top):
+        """Show blob store usage and what JPEG recompression saved."""
+        from sqlalchemy import func
+        from app import db
+        from app.models import Blob
+
+        def mb(size):
+            return f'{(size or 0) / (1024 * 1024):.1f} MB'
+
+        count, stored, references = db.session.query(func.count(Blob.digest), func.sum(Blob.size), func.sum(Blob.ref_count)).one()
+        click.echo(f'{count} file tersimpan ({mb(stored)}) untuk {references or 0} surat.')
+        optimized = Blob.original_size.isnot(None)
+        count, uploaded, stored = db.session.query(func.count(Blob.digest), func.sum(Blob.original_size), func.sum(Blob.size)).filter(optimized).one()
+        if not count:
+            click.echo('Belum ada JPEG yang dikompresi ulang.')
+            return
+        saved = (uploaded or 0) - (stored or 0)
+        click.echo(f'{count} JPEG dikompresi ulang: {mb(uploaded)} -> {mb(stored)}, hemat {mb(saved)} ({saved * 100 / uploaded:.0f}%).')
+        savings = (Blob.original_size - Blob.size).label('saved')
+        for digest, original_size, size, _ in (db.session.query(Blob.digest, Blob.original_size, Blob.size, savings)
+                                               .filter(optimized).order_by(savings.desc()).limit(top)):
+            click.echo(f'  {digest[:12]}: {mb(original_size)} -> {mb(size)}')
+
+    @app.cli.command('storage-reconcile')
+    @click.option('--dry-run', is_flag=True, help='Hanya laporkan, jangan pindahkan file.')
+    @click.option('--rate', type=float, default=None, help='Batas file per detik agar disk tidak terbebani.')
+    @click.option('--grace', type=int, default=3600, help='File yang lebih baru dari sekian detik tidak dianggap yatim.')
+    @click.option('--batch', type=int, default=1000, help='Jumlah baris per query database.')
+    def storage_reconcile(dry_run, rate, grace, batch):
+        """Find orphaned files and rows whose file is missing; quarantine the orphans."""
+        from app.downloads import upload_root
+        from app.reconcile import Reconciler
+        from app.routes import surat_masuk, surat_keluar
+        from app.storage import get_blob_store
+        areas = {
+            'surat_masuk': (LIST_SPECS['masuk'].model, surat_masuk.UPLOAD_FOLDER),
+            'surat_keluar': (LIST_SPECS['keluar'].model, surat_keluar.UPLOAD_FOLDER),
+        }
+        reconciler = Reconciler(upload_root(), get_blob_store().root, areas, dry_run=dry_run,
+                                rate=rate, grace=grace, batch_size=batch)
+        counts = {'orphan': 0, 'dangling': 0, 'unknown': 0}
+        for finding in reconciler.run():
+            counts[finding.kind] += 1
+            click.echo(str(finding))
+        if dry_run:
+            action = 'tidak ada yang dipindahkan (dry run)'
+        elif counts['orphan']:
+            action = f'file yatim dipindahkan ke {reconciler.quarantine_root}'
+        else:
+            action = 'tidak ada yang dipindahkan'
+        click.echo(f"{counts['orphan']} file yatim, {counts['dangling']} baris tanpa file, {counts['unknown']} entri tak dikenal; {action}.")
+
+    @app.cli.command('preview-generate')
+    @click.option('--force', is_flag=True, help='Render ulang meskipun pratinjau sudah ada.')
+    def preview_generate(force):
+        """Render missing thumbnails and previews for every stored blob."""
+        from concurrent.futures import wait
+        from app.models import Blob
+        from app.previews import schedule_previews
+        futures = []
+        for blob in Blob.query.yield_per(500):
+            future = schedule_previews(blob.digest, blob.mime_type, force=force)
+            if future is not None:
+                futures.append(future)
+        wait(futures)
+        rendered = sum(1 for future in futures if future.exception() is None and future.result())
+        click.echo(f'{len(futures)} blob diproses, {rendered} pratinjau dibuat.')
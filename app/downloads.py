@@ -0,0 +1,204 @@
+import mimetypes
+import os
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Response, abort, current_app, request, send_file, stream_with_context
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import safe_join, secure_filename
+from app import db
+from app.export import ZipStream
+from app.jobs import enqueue
+from app.models import Blob
+from app.pagination import build_seek_query
+from app.storage import blob_job_key, get_blob_store, legacy_display_name
+
+OFFLOAD_MODES = ('none', 'x-accel', 'x-sendfile')
+
+# PDF, JPEG and DOCX (itself a ZIP) are compressed already; deflating them
+# again costs CPU and saves next to nothing, so they are stored as-is
+PRECOMPRESSED_MIME_TYPES = {
+    'application/pdf',
+    'image/jpeg',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+# Letters fetched per round trip, and bytes read per file chunk, while zipping
+ARCHIVE_BATCH_SIZE = 500
+_ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+
+def upload_root():
+    return os.path.join(os.getcwd(), current_app.config.get('UPLOAD_FOLDER', 'app/uploads'))
+
+
+def letter_file_path(surat, legacy_folder):
+    """Absolute path of a letter's file: its blob, or the legacy uuid-named
+    file in ``legacy_folder``. Raises FileNotFoundError when it is missing."""
+    if surat.file_digest:
+        store = get_blob_store()
+        path = os.path.join(store.root, store.locate(surat.file_digest))
+    else:
+        path = safe_join(legacy_folder, surat.file_path)
+    if not path or not os.path.isfile(path):
+        raise FileNotFoundError(surat.file_path)
+    return path
+
+
+def _validators(surat):
+    # Blob digests are content hashes and make strong ETags; legacy files have
+    # none, so direct serving falls back to werkzeug's mtime/size ETag
+    last_modified = surat.updated_at.replace(tzinfo=timezone.utc) if surat.updated_at else None
+    return surat.file_digest, last_modified
+
+
+def _revalidate_each_time(response):
+    # Downloads are private and must pass the auth checks on every use, so
+    # browsers keep them but revalidate (and get a 304 when unchanged)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    return response
+
+
+def send_letter_file(surat, legacy_folder):
+    """Download response for a letter's file, after the caller's auth checks.
+
+    DOWNLOAD_OFFLOAD picks who moves the bytes:
+    'x-accel'    nginx, through an internal location mapped onto UPLOAD_FOLDER
+                 at DOWNLOAD_ACCEL_PREFIX;
+    'x-sendfile' Apache mod_xsendfile / lighttpd, given the absolute path;
+    'none'       the app itself. The open file is handed to the server's
+                 wsgi.file_wrapper, which gunicorn serves with os.sendfile,
+                 so no bytes are copied through Python.
+
+    In every mode If-None-Match / If-Modified-Since are answered with a 304
+    from the blob digest and updated_at. Range requests get a 206: from
+    send_file when serving directly, from the proxy's own range support
+    when offloaded.
+    """
+    path = letter_file_path(surat, legacy_folder)
+    download_name = surat.file_path if surat.file_digest else legacy_display_name(surat.file_path)
+    etag, last_modified = _validators(surat)
+    mode = current_app.config.get('DOWNLOAD_OFFLOAD', 'none')
+    if mode not in OFFLOAD_MODES:
+        raise ValueError(f'Unknown DOWNLOAD_OFFLOAD: {mode}')
+    if mode == 'none':
+        response = send_file(
+            path,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=etag or True,
+            last_modified=last_modified,
+        )
+        return _revalidate_each_time(response)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        # Headers only; the proxy streams the file and sets Content-Length
+        response = current_app.response_class(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+        if mode == 'x-accel':
+            relative = os.path.relpath(path, upload_root()).replace(os.sep, '/')
+            prefix = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+        else:
+            response.headers['X-Sendfile'] = path
+        # file_path went through secure_filename, so it is plain ASCII
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return _revalidate_each_time(response)
+
+
+def send_letter_preview(surat, variant):
+    """Rendered preview image of a letter (see app.previews), after the
+    caller's auth checks. 404 while the worker has not rendered it yet or
+    when the file type cannot be previewed."""
+    if not surat.file_digest:
+        abort(404)
+    store = get_blob_store()
+    path = store.derived_path(surat.file_digest, variant)
+    if not os.path.exists(path):
+        blob = db.session.get(Blob, surat.file_digest)
+        if blob is not None:
+            # Blobs stored before the job queue existed; the key makes this a
+            # single lookup once the job is there
+            enqueue('previews.render', {'digest': blob.digest}, key=blob_job_key('previews.render', blob))
+            db.session.commit()
+        abort(404)
+    # Previews are derived from the content alone, so the digest identifies them
+    response = send_file(path, mimetype='image/jpeg', conditional=True, etag=f'{surat.file_digest}-{variant}')
+    return _revalidate_each_time(response)
+
+
+def _archive_rows(filters):
+    # Same order as the list, relevance included: apply() leaves sort_column
+    # on the rank expression even though the rank itself is not loaded
+    spec = filters.spec
+    model = spec.model
+    query = (db.session.query(model.id, model.nomor_surat, model.file_path, model.file_digest, model.updated_at, Blob.mime_type)
+             .select_from(model).outerjoin(Blob, Blob.digest == model.file_digest))
+    query = filters.apply(query, with_rank=False)
+    query = build_seek_query(query, filters.sort_column, model.id, filters.sort_order == 'desc')
+    return query.yield_per(ARCHIVE_BATCH_SIZE)
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(_ARCHIVE_CHUNK_SIZE), b''):
+            yield chunk
+
+
+def _entry_name(row, used):
+    display_name = row.file_path if row.file_digest else legacy_display_name(row.file_path)
+    name = f'{secure_filename(row.nomor_surat) or row.id}_{display_name}'
+    if name in used:
+        name = f'{row.id}_{name}'
+    used.add(name)
+    return name
+
+
+def iter_letter_archive(rows, legacy_folder):
+    """Yield a ZIP of the files of ``rows``, one file chunk at a time.
+
+    Only the chunk being written is held in memory, plus zipfile's central
+    directory entry (a name and a few integers) per file.
+    """
+    archive = ZipStream()
+    used = set()
+    missing = []
+    for row in rows:
+        try:
+            path = letter_file_path(row, legacy_folder)
+        except FileNotFoundError:
+            missing.append(row.nomor_surat)
+            continue
+        name = _entry_name(row, used)
+        mime_type = row.mime_type or mimetypes.guess_type(name)[0]
+        # ZIP timestamps cannot predate 1980
+        modified = max(row.updated_at or datetime.now(), datetime(1980, 1, 1))
+        yield from archive.add(
+            name,
+            _read_chunks(path),
+            compress=mime_type not in PRECOMPRESSED_MIME_TYPES,
+            date_time=modified.timetuple()[:6],
+        )
+    if missing:
+        listing = 'File untuk surat berikut tidak ditemukan:\n' + '\n'.join(missing) + '\n'
+        yield from archive.add('TIDAK_DITEMUKAN.txt', [listing.encode('utf-8')])
+    yield from archive.close()
+
+
+def send_letter_archive(filters, legacy_folder):
+    """Streaming ZIP of the files of every letter matching ``filters``, after
+    the caller's auth checks. Built while it is sent: no temporary file,
+    no Content-Length."""
+    basename = f"{filters.spec.model.__tablename__}_{datetime.now().strftime('%Y%m%d')}"
+    body = iter_letter_archive(_archive_rows(filters), legacy_folder)
+    response = Response(stream_with_context(body), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{basename}.zip"'
+    return _revalidate_each_time(response)
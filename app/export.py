@@ -0,0 +1,228 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+from flask import Response, stream_with_context
+from app import db
+from app.models import User
+from app.pagination import build_seek_query
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+# Characters that are not allowed in XML 1.0 documents
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable file object that hands out what zipfile wrote."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """Builds a ZIP archive on the fly and yields it in chunks.
+
+    zipfile falls back to data descriptors when its file object cannot seek,
+    so nothing is buffered beyond the chunk currently being compressed.
+    """
+
+    def __init__(self):
+        self._sink = _ZipSink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add(self, name, chunks, compress=True, date_time=None, force_zip64=False):
+        info = zipfile.ZipInfo(name, date_time or datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with self._zip.open(info, 'w', force_zip64=force_zip64) as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+                data = self._sink.drain()
+                if data:
+                    yield data
+        data = self._sink.drain()
+        if data:
+            yield data
+
+    def close(self):
+        self._zip.close()
+        yield self._sink.drain()
+
+
+def export_columns(spec):
+    """(header, column) pairs of an export, in sheet order."""
+    model = spec.model
+    return [
+        ('Nomor Surat', model.nomor_surat),
+        (spec.party_label, getattr(model, spec.party_field)),
+        (spec.date_label, getattr(model, spec.date_field)),
+        ('Perihal', model.perihal),
+        ('Diunggah Oleh', User.nama_lengkap),
+    ]
+
+
+def iter_export_rows(filters):
+    """Stream the rows matching ``filters`` in list order, batch by batch."""
+    spec = filters.spec
+    model = spec.model
+    columns = [column for _, column in export_columns(spec)]
+    query = db.session.query(*columns).select_from(model).join(User, model.uploader)
+    query = filters.apply(query, with_rank=False)
+    query = build_seek_query(query, filters.sort_column, model.id, filters.sort_order == 'desc')
+    # yield_per turns on stream_results, i.e. a server-side cursor on MySQL
+    for row in query.yield_per(EXPORT_BATCH_SIZE):
+        yield tuple(row)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    value = str(value)
+    # Keep spreadsheet apps from evaluating user-entered text as a formula
+    if value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def iter_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the file as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _xlsx_cell(reference, value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        # Excel stores dates as days since 1899-12-30; style 1 formats them
+        serial = (value - date(1899, 12, 30)).days
+        return f'<c r="{reference}" s="1"><v>{serial}</v></c>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{reference}"><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL_RE.sub('', str(value)))
+    return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_row(letters, number, values):
+    cells = ''.join(_xlsx_cell(f'{letters[i]}{number}', value) for i, value in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+def _iter_sheet_xml(header, rows):
+    letters = [_column_letter(i) for i in range(len(header))]
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    ).encode('utf-8')
+    lines = [_xlsx_row(letters, 1, header)]
+    for number, row in enumerate(rows, 2):
+        lines.append(_xlsx_row(letters, number, row))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield ''.join(lines).encode('utf-8')
+            lines = []
+    lines.append('</sheetData></worksheet>')
+    yield ''.join(lines).encode('utf-8')
+
+
+_XLSX_STATIC_PARTS = [
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Surat" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+     '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+     '</Relationships>'),
+    ('xl/styles.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+     '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd-mm-yyyy"/></numFmts>'
+     '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+     '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+     '<borders count="1"><border/></borders>'
+     '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+     '<cellXfs count="2"><xf/><xf numFmtId="164" applyNumberFormat="1"/></cellXfs>'
+     '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+     '</styleSheet>'),
+]
+
+
+def iter_xlsx(header, rows):
+    archive = ZipStream()
+    for name, content in _XLSX_STATIC_PARTS:
+        yield from archive.add(name, [content.encode('utf-8')])
+    yield from archive.add('xl/worksheets/sheet1.xml', _iter_sheet_xml(header, rows))
+    yield from archive.close()
+
+
+def export_response(filters, fmt):
+    """Streaming download of every letter matching ``filters`` as CSV or XLSX."""
+    header = [label for label, _ in export_columns(filters.spec)]
+    rows = iter_export_rows(filters)
+    basename = f"{filters.spec.model.__tablename__}_{datetime.now().strftime('%Y%m%d')}"
+    if fmt == 'xlsx':
+        body, mimetype, filename = iter_xlsx(header, rows), XLSX_MIMETYPE, f'{basename}.xlsx'
+    else:
+        body, mimetype, filename = iter_csv(header, rows), 'text/csv; charset=utf-8', f'{basename}.csv'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
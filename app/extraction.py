@@ -0,0 +1,147 @@
+import os
+import zipfile
+import zlib
+from datetime import datetime
+from xml.etree import ElementTree
+from flask import current_app
+from app import db
+from app.jobs import job_handler
+from app.models import Blob, BlobText
+from app.previews import DOCX_MIME, PDF_MIME
+from app.search import tokenize
+from app.storage import get_blob_store
+from app.utils import ProcessPool
+
+try:
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+except ImportError: # pypdf is optional; without it PDFs are not searchable by content
+    PdfReader = None
+    PyPdfError = ValueError
+
+# Bump when extraction changes so `flask text-extract` redoes older rows
+EXTRACTOR_VERSION = 1
+
+EXTRACTABLE_MIME_TYPES = {PDF_MIME, DOCX_MIME}
+
+# Upper bound on the words kept for the full-text indexes (MySQL TEXT-sized)
+SEARCH_TEXT_MAX_LENGTH = 60000
+# A real document.xml is a few MB at most; anything bigger is a zip bomb
+MAX_DOCX_XML_SIZE = 50 * 1024 * 1024
+
+_pool = ProcessPool()
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Errors that mean the file itself cannot be read; retrying will not help
+UNREADABLE_ERRORS = (zipfile.BadZipFile, KeyError, ElementTree.ParseError, PyPdfError, ValueError)
+
+
+def docx_text(path):
+    """Body text of a DOCX, streamed out of word/document.xml."""
+    parts = []
+    with zipfile.ZipFile(path) as docx:
+        info = docx.getinfo('word/document.xml')
+        if info.file_size > MAX_DOCX_XML_SIZE:
+            raise ValueError('document.xml is too large')
+        with docx.open(info) as xml:
+            for _, element in ElementTree.iterparse(xml):
+                if element.tag == _W + 't':
+                    parts.append(element.text or '')
+                elif element.tag == _W + 'tab':
+                    parts.append('\t')
+                elif element.tag in (_W + 'br', _W + 'cr'):
+                    parts.append('\n')
+                elif element.tag == _W + 'p':
+                    parts.append('\n')
+                    # Runs are handled by now; keep memory flat on long documents
+                    element.clear()
+    return ''.join(parts)
+
+
+def pdf_text(path, max_pages):
+    """Text layer of the first ``max_pages`` pages. Scans without one yield ''."""
+    if PdfReader is None:
+        return ''
+    reader = PdfReader(path)
+    if reader.is_encrypted and not reader.decrypt(''):
+        return ''
+    return '\n'.join(page.extract_text() or '' for page in reader.pages[:max_pages])
+
+
+def extract_text(path, mime_type, max_pages=200, max_chars=1000000):
+    if mime_type == PDF_MIME:
+        text = pdf_text(path, max_pages)
+    elif mime_type == DOCX_MIME:
+        text = docx_text(path)
+    else:
+        return ''
+    return text[:max_chars]
+
+
+def search_words(text, limit=SEARCH_TEXT_MAX_LENGTH):
+    """Distinct lower-case words of ``text`` in order of appearance, space
+    separated and cut at ``limit`` characters. Repeats add nothing to a
+    match, so indexing each word once keeps the indexes small."""
+    seen = set()
+    words = []
+    length = 0
+    for token in tokenize(text):
+        if token in seen:
+            continue
+        length += len(token) + 1
+        if length > limit:
+            break
+        seen.add(token)
+        words.append(token)
+    return ' '.join(words)
+
+
+def extract_blob_text(digest, force=False):
+    """Extract and store the text of one blob. Returns its BlobText, or None
+    when the blob is gone or not a document. Part of the caller's transaction.
+
+    Text is keyed by content digest, so it is extracted once per distinct
+    file and only again when EXTRACTOR_VERSION moves.
+    """
+    blob = db.session.get(Blob, digest)
+    if blob is None or blob.mime_type not in EXTRACTABLE_MIME_TYPES:
+        return None
+    row = blob.extracted_text
+    if row is not None and row.extractor_version >= EXTRACTOR_VERSION and not force:
+        return row
+    store = get_blob_store()
+    config = current_app.config
+    args = (
+        os.path.join(store.root, store.locate(digest)),
+        blob.mime_type,
+        config.get('TEXT_EXTRACT_MAX_PAGES', 200),
+        config.get('TEXT_EXTRACT_MAX_CHARS', 1000000),
+    )
+    try:
+        workers = config.get('TEXT_EXTRACT_WORKERS', 2)
+        if workers > 0:
+            # Parsing is CPU-bound pure Python; keep it off this process's GIL
+            text = _pool.submit(workers, extract_text, *args).result()
+        else:
+            text = extract_text(*args)
+    except UNREADABLE_ERRORS as e:
+        # Stored as empty so the file is not parsed again on every run
+        current_app.logger.warning(f'Could not extract text from blob {digest[:12]}: {e}')
+        text = ''
+    if row is None:
+        row = BlobText(digest=digest)
+        blob.extracted_text = row
+    row.extractor_version = EXTRACTOR_VERSION
+    row.char_count = len(text)
+    row.content = zlib.compress(text.encode('utf-8'), 6)
+    row.search_text = search_words(text)
+    row.extracted_at = datetime.utcnow()
+    return row
+
+
+@job_handler('text.extract')
+def _extract_job(digest):
+    # Queued by app.storage.add_reference for every new blob; committed
+    # together with the job's 'done' status
+    extract_blob_text(digest)
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, TextAreaField, SubmitField, DateField, PasswordField, SelectField, EmailField
 from wtforms.validators import DataRequired, Length, ValidationError, EqualTo, Email
 from datetime import date
@@ -45,11 +45,6 @@ class SuratMasukForm(FlaskForm):
     ])
     submit = SubmitField('Simpan')
 
-    def validate_file_surat(self, field):
-        if field.data:
-            if field.data.content_length > 5 * 1024 * 1024: # 5 MB
-                raise ValidationError('Ukuran file terlalu besar (maksimal 5MB).')
-
 class SuratKeluarForm(FlaskForm):
     nomor_surat = StringField('Nomor Surat', validators=[DataRequired(), Length(max=100)])
     tujuan_surat = StringField('Tujuan Surat', validators=[DataRequired(), Length(max=100)])
@@ -60,10 +55,16 @@ class SuratKeluarForm(FlaskForm):
     ])
     submit = SubmitField('Simpan')
 
-    def validate_file_surat(self, field):
-        if field.data:
-            if field.data.content_length > 5 * 1024 * 1024: # 5 MB
-                raise ValidationError('Ukuran file terlalu besar (maksimal 5MB).')
+class ImportSuratForm(FlaskForm):
+    manifest = FileField('Manifest (CSV)', validators=[
+        FileRequired('Manifest harus diunggah.'),
+        FileAllowed(['csv'], 'Manifest harus berupa file CSV.'),
+    ])
+    arsip = FileField('Arsip File Surat (ZIP)', validators=[
+        FileRequired('Arsip ZIP harus diunggah.'),
+        FileAllowed(['zip'], 'Arsip harus berupa file ZIP.'),
+    ])
+    submit = SubmitField('Impor')
 
 class TokenVerificationForm(FlaskForm):
     access_token = StringField('Kode Akses', validators=[DataRequired()])
@@ -0,0 +1,42 @@
+import hashlib
+import io
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow is optional; without it JPEG uploads are stored as sent
+    Image = None
+
+# Derived variant holding the untouched upload when JPEG_KEEP_ORIGINAL is on
+ORIGINAL = 'original.jpg'
+
+
+def recompress_jpeg(source, target, quality, max_dimension):
+    """Re-encode the JPEG at ``source`` into ``target``: upright per its EXIF
+    orientation, scaled to fit ``max_dimension``, with EXIF/XMP/comments
+    dropped (the ICC profile is kept so colours do not shift).
+
+    Runs in a worker process, so it only deals with paths. Returns
+    (sha256 hex, size, width, height) of the new file, or None when the
+    original is better kept: already small, unscaled and without metadata.
+    """
+    with Image.open(source) as image:
+        original_size = image.size
+        had_metadata = 'exif' in image.info or 'xmp' in image.info or 'comment' in image.info
+        icc_profile = image.info.get('icc_profile')
+        # Let the decoder downscale by powers of two before the exact resize
+        image.draft('RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True, icc_profile=icc_profile)
+        width, height = image.size
+    data = buffer.getvalue()
+    scaled = max(original_size) > max_dimension
+    if not scaled and not had_metadata and len(data) >= os.path.getsize(source):
+        return None
+    with open(target, 'wb') as out:
+        out.write(data)
+    return hashlib.sha256(data).hexdigest(), len(data), width, height
@@ -0,0 +1,229 @@
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from app import db
+from app.cache import count_cache
+from app.storage import (ALLOWED_MIME_TYPES, MAX_UPLOAD_SIZE, UploadRejected, add_reference,
+                         discard_unreferenced, get_blob_store, read_head, sniff_mime)
+
+# nomor_surat values looked up per IN (...) query
+_LOOKUP_CHUNK = 500
+
+
+def manifest_columns(spec):
+    """Column names a manifest for ``spec`` must have, in export order."""
+    return ['nomor_surat', spec.party_field, spec.date_field, 'perihal', 'file']
+
+
+class ImportRow:
+    def __init__(self, line, values, file_name):
+        self.line = line
+        self.values = values
+        self.file_name = file_name
+        self.digest = None
+        self.size = None
+        self.mime_type = None
+        self.committed = False
+
+
+class ImportReport:
+    """Outcome of one import: inserted rows and per-row errors."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.errors = [] # (manifest line, nomor_surat, message)
+
+    def add_error(self, row_or_line, nomor_surat, message):
+        line = row_or_line.line if isinstance(row_or_line, ImportRow) else row_or_line
+        self.errors.append((line, nomor_surat, message))
+
+    def error_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['baris', 'nomor_surat', 'kesalahan'])
+        writer.writerows(sorted(self.errors))
+        return buffer.getvalue()
+
+
+def _read_manifest(spec, manifest, report):
+    sample = manifest.read(4096)
+    manifest.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(manifest, dialect=dialect)
+    missing = [column for column in manifest_columns(spec) if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Kolom manifest tidak lengkap: {', '.join(missing)}")
+
+    rows = []
+    for record in reader:
+        line = reader.line_num
+        nomor_surat = (record['nomor_surat'] or '').strip()
+        party = (record[spec.party_field] or '').strip()
+        perihal = (record['perihal'] or '').strip()
+        file_name = (record['file'] or '').strip()
+        if not all([nomor_surat, party, perihal, file_name, (record[spec.date_field] or '').strip()]):
+            report.add_error(line, nomor_surat, 'Kolom wajib kosong.')
+            continue
+        if len(nomor_surat) > 100 or len(party) > 100:
+            report.add_error(line, nomor_surat, 'Nomor surat atau kolom asal/tujuan melebihi 100 karakter.')
+            continue
+        try:
+            letter_date = datetime.strptime(record[spec.date_field].strip(), '%Y-%m-%d').date()
+        except ValueError:
+            report.add_error(line, nomor_surat, 'Format tanggal tidak valid (gunakan YYYY-MM-DD).')
+            continue
+        values = {
+            'nomor_surat': nomor_surat,
+            spec.party_field: party,
+            spec.date_field: letter_date,
+            'perihal': perihal,
+        }
+        rows.append(ImportRow(line, values, file_name))
+    return rows
+
+
+def _drop_conflicts(spec, rows, report):
+    """Remove rows whose nomor_surat repeats in the manifest or already exists."""
+    model = spec.model
+    seen = set()
+    unique_rows = []
+    for row in rows:
+        nomor_surat = row.values['nomor_surat']
+        if nomor_surat in seen:
+            report.add_error(row, nomor_surat, 'Nomor surat ganda di dalam manifest.')
+            continue
+        seen.add(nomor_surat)
+        unique_rows.append(row)
+
+    existing = set()
+    numbers = list(seen)
+    for start in range(0, len(numbers), _LOOKUP_CHUNK):
+        chunk = numbers[start:start + _LOOKUP_CHUNK]
+        existing.update(value for (value,) in db.session.query(model.nomor_surat).filter(model.nomor_surat.in_(chunk)))
+
+    kept = []
+    for row in unique_rows:
+        if row.values['nomor_surat'] in existing:
+            report.add_error(row, row.values['nomor_surat'], 'Nomor surat sudah ada.')
+        else:
+            kept.append(row)
+    return kept
+
+
+def _store_file(archive, members, row, store):
+    """Sniff one scan and copy it into the blob store; runs in a worker thread.
+    Returns an error message or None."""
+    info = members.get(row.file_name)
+    if info is None:
+        return f'File {row.file_name} tidak ada di dalam arsip ZIP.'
+    if info.file_size > MAX_UPLOAD_SIZE:
+        # Cheap early reject; store.write enforces the limit on the real bytes
+        return 'Ukuran file terlalu besar (maksimal 5MB).'
+    try:
+        # ZipFile serialises access to the underlying file; decompression runs in parallel
+        with archive.open(info) as source:
+            head = read_head(source)
+            mime_type = sniff_mime(head)
+            if mime_type not in ALLOWED_MIME_TYPES:
+                return 'Jenis file tidak diizinkan. Hanya PDF, DOCX, dan JPG yang diperbolehkan.'
+            row.digest, row.size = store.write(source, head=head, max_size=MAX_UPLOAD_SIZE)
+            row.mime_type = mime_type
+    except UploadRejected as e:
+        return str(e)
+    except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+        return f'Gagal mengekstrak file: {e}'
+    return None
+
+
+def _params(row, uploaded_by_user_id):
+    return dict(
+        row.values,
+        file_path=secure_filename(os.path.basename(row.file_name)) or row.digest,
+        file_digest=row.digest,
+        uploaded_by_user_id=uploaded_by_user_id,
+    )
+
+
+def _insert_rows(spec, rows, uploaded_by_user_id, report, batch_size):
+    table = spec.model.__table__
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        params = [_params(row, uploaded_by_user_id) for row in batch]
+        try:
+            for row in batch:
+                add_reference(row.digest, row.size, row.mime_type)
+            # A list of parameter sets is sent as one executemany
+            db.session.execute(insert(table), params)
+            db.session.commit()
+            for row in batch:
+                row.committed = True
+            report.inserted += len(batch)
+            continue
+        except IntegrityError:
+            db.session.rollback()
+        # Someone else inserted a conflicting nomor_surat meanwhile: retry row by row
+        for row, values in zip(batch, params):
+            try:
+                add_reference(row.digest, row.size, row.mime_type)
+                db.session.execute(insert(table), values)
+                db.session.commit()
+                row.committed = True
+                report.inserted += 1
+            except IntegrityError:
+                db.session.rollback()
+                report.add_error(row, row.values['nomor_surat'], 'Nomor surat sudah ada.')
+                discard_unreferenced(row.digest)
+
+
+def import_letters(spec, manifest, archive_file, uploaded_by_user_id, workers=4, batch_size=500):
+    """Import letters described by a CSV ``manifest`` (text stream) whose scans
+    are in the ZIP ``archive_file`` (path or binary file object).
+
+    Rows that fail validation are skipped and reported; the rest are inserted
+    in batches. Raises ValueError when the manifest or archive is unusable.
+    """
+    report = ImportReport()
+    rows = _read_manifest(spec, manifest, report)
+    rows = _drop_conflicts(spec, rows, report)
+    if not rows:
+        return report
+
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except zipfile.BadZipFile:
+        raise ValueError('Arsip bukan file ZIP yang valid.')
+    store = get_blob_store()
+    with archive:
+        members = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda row: _store_file(archive, members, row, store), rows))
+
+    stored = []
+    for row, error in zip(rows, results):
+        if error:
+            report.add_error(row, row.values['nomor_surat'], error)
+        else:
+            stored.append(row)
+
+    try:
+        _insert_rows(spec, stored, uploaded_by_user_id, report, batch_size)
+    except Exception:
+        db.session.rollback()
+        for row in stored:
+            if not row.committed:
+                discard_unreferenced(row.digest)
+        raise
+    finally:
+        # Core inserts bypass the ORM change hooks, so cached totals are stale
+        if report.inserted:
+            count_cache.invalidate(spec.model)
+    return report
@@ -0,0 +1,136 @@
+from datetime import date
+from sqlalchemy import Date, DateTime, Integer, Numeric
+from app import db
+from app.pagination import build_seek_query
+from app.queries import SORT_RELEVANCE, ListFilter, list_query
+
+# Literal stand-ins for request values; EXPLAIN only cares about their shape
+SAMPLE_OWNER_ID = 1
+DATE_RANGES = {
+    'tanpa tanggal': (None, None),
+    'dari tanggal': (date(2024, 1, 1), None),
+    'rentang tanggal': (date(2024, 1, 1), date(2024, 12, 31)),
+}
+# Search terms by the path they take through the backend: indexed words,
+# words too short for MySQL's FULLTEXT next to indexed ones, and no words at
+# all (LIKE on every backend)
+SEARCH_TERMS = {
+    'kata': 'rapat',
+    'kata pendek': 'sk rapat',
+    'tanpa kata': '/',
+}
+
+
+class PlanReport:
+    """EXPLAIN result for one filter/sort combination of a list view."""
+
+    def __init__(self, label, sql, plan, full_scans, filesort):
+        self.label = label
+        self.sql = sql
+        self.plan = plan
+        self.full_scans = full_scans # tables read without any index
+        self.filesort = filesort # ORDER BY needs a separate sort step
+
+    @property
+    def ok(self):
+        return not self.full_scans and not self.filesort
+
+
+def _sample_value(column, sort_by):
+    column_type = column.type
+    if isinstance(column_type, DateTime):
+        return date(2024, 6, 1)
+    if isinstance(column_type, Date):
+        return date(2024, 6, 1)
+    if isinstance(column_type, Integer):
+        return 1
+    if isinstance(column_type, Numeric) or sort_by == SORT_RELEVANCE:
+        return 1.0
+    return 'M'
+
+
+def _virtual_lookup(line):
+    marker = 'VIRTUAL TABLE INDEX '
+    return marker in line and line.split(marker, 1)[1].split(':', 1)[-1].strip() != ''
+
+
+def explain(query):
+    """Run EXPLAIN for ``query`` and return (sql, plan lines, full scans, filesort)."""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'mysql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + sql).mappings().all()
+        plan = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}".strip() for row in rows]
+        full_scans = [row['table'] for row in rows if row['type'] == 'ALL']
+        filesort = any('Using filesort' in (row['Extra'] or '') for row in rows)
+    elif dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).all()
+        plan = [row[-1] for row in rows]
+        # "SCAN t" reads the whole table, "SCAN t USING INDEX ix" walks an index in order;
+        # an FTS table with a constraint ("VIRTUAL TABLE INDEX 0:M1", a MATCH) is a lookup
+        full_scans = [line.split()[1] for line in plan if line.startswith('SCAN ') and ' USING ' not in line
+                      and not _virtual_lookup(line)]
+        filesort = any('TEMP B-TREE FOR ORDER BY' in line for line in plan)
+    else:
+        raise RuntimeError(f'EXPLAIN is not supported for {dialect.name}')
+    return sql, plan, full_scans, filesort
+
+
+def _searches(spec):
+    """(label, search_by, term) for no search and every search field and term."""
+    yield None, None, ''
+    for search_by in spec.search_fields:
+        for term_name, term in SEARCH_TERMS.items():
+            yield f'cari={search_by} ({term_name})', search_by, term
+
+
+def advise(spec, per_page=10):
+    """Yield a PlanReport for every owner/search/sort/date combination the
+    list route can produce, for both the first page and a following page.
+
+    Searches run through the configured search backend exactly as
+    ListFilter.apply does (FULLTEXT/FTS, LIKE fallback, relevance order);
+    they are explained without a date filter, since date filters are
+    already covered by the plain list.
+    """
+    model = spec.model
+    for owner_id in (None, SAMPLE_OWNER_ID):
+        for search_label, search_by, term in _searches(spec):
+            sorts = spec.sort_fields + [SORT_RELEVANCE] if term else spec.sort_fields
+            date_ranges = DATE_RANGES if not term else {'tanpa tanggal': DATE_RANGES['tanpa tanggal']}
+            for sort_by in sorts:
+                for sort_order in ('asc', 'desc'):
+                    for range_name, (start_date, end_date) in date_ranges.items():
+                        filters = ListFilter(
+                            spec,
+                            search_query=term,
+                            search_by=search_by,
+                            start_date=start_date,
+                            end_date=end_date,
+                            sort_by=sort_by,
+                            sort_order=sort_order,
+                            owner_id=owner_id,
+                        )
+                        base = filters.apply(list_query(spec))
+                        sort_column = filters.sort_column
+                        for seek in (False, True):
+                            after = (_sample_value(sort_column, filters.sort_by), 1) if seek and filters.seek else None
+                            query = build_seek_query(base, sort_column, model.id, sort_order == 'desc', after)
+                            if seek and not filters.seek:
+                                # Paged by OFFSET (see ListFilter.seek)
+                                query = query.offset(per_page)
+                            query = query.limit(per_page + 1)
+                            sql, plan, full_scans, filesort = explain(query)
+                            # A relevance sort the backend cannot rank falls back to the default sort
+                            sort_label = sort_by if filters.sort_by == sort_by else f'{sort_by}->{filters.sort_by}'
+                            label = ' '.join(part for part in [
+                                model.__tablename__,
+                                'anggota' if owner_id else 'admin',
+                                search_label,
+                                f'sort={sort_label}:{sort_order}',
+                                f'[{range_name}]',
+                                'cursor' if seek else 'halaman pertama',
+                            ] if part)
+                            yield PlanReport(label, sql, plan, full_scans, filesort)
@@ -0,0 +1,235 @@
+import json
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Job
+
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+# File in UPLOAD_FOLDER naming the volume it lives on. Jobs carry the id of
+# the volume they were queued on and refuse to run anywhere else.
+VOLUME_MARKER = '.volume-id'
+
+_handlers = {}
+_volume_ids = {}
+_background_worker = {'pid': None}
+
+
+class VolumeMismatch(RuntimeError):
+    pass
+
+
+def volume_id(app):
+    """Id of the UPLOAD_FOLDER this process sees, created on first use."""
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    if folder not in _volume_ids:
+        path = os.path.join(folder, VOLUME_MARKER)
+        os.makedirs(folder, exist_ok=True)
+        try:
+            with open(path, 'x') as marker:
+                marker.write(secrets.token_hex(8))
+        except FileExistsError:
+            pass
+        with open(path) as marker:
+            _volume_ids[folder] = marker.read().strip()
+    return _volume_ids[folder]
+
+
+def job_handler(kind):
+    """Register the decorated function as the handler for jobs of ``kind``.
+    It is called with the job's payload as keyword arguments, inside an app
+    context; whatever it changes in the session commits with the job's
+    'done' status."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, key=None, delay=0, max_attempts=None):
+    """Add a job to the caller's transaction, so it only becomes visible to
+    workers once that transaction commits (and vanishes if it rolls back).
+
+    With an idempotency ``key``, a job already enqueued under that key is
+    returned instead of a new one.
+    """
+    if key is not None:
+        existing = Job.query.filter_by(idempotency_key=key).first()
+        if existing is not None:
+            return existing
+    # Every job works on files under UPLOAD_FOLDER; see run_job
+    payload = dict(payload or {}, _volume=volume_id(current_app))
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        idempotency_key=key,
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    if key is None:
+        db.session.add(job)
+        return job
+    try:
+        with db.session.begin_nested():
+            db.session.add(job)
+    except IntegrityError:
+        # A concurrent request enqueued the same key first
+        return Job.query.filter_by(idempotency_key=key).first()
+    return job
+
+
+def retry_delay(attempts, base, cap):
+    """Exponential backoff with jitter, so failing jobs do not retry in lockstep."""
+    return min(cap, base * 2 ** max(attempts - 1, 0)) * random.uniform(0.8, 1.2)
+
+
+def requeue_stale(lock_timeout):
+    """Hand jobs of workers that died mid-run back to the queue."""
+    now = datetime.utcnow()
+    stale = (Job.status == 'running') & (Job.locked_at < now - timedelta(seconds=lock_timeout))
+    lost = 'Worker stopped before the job finished'
+    db.session.execute(
+        update(Job).where(stale, Job.attempts >= Job.max_attempts)
+        .values(status='failed', locked_by=None, last_error=lost, finished_at=now)
+    )
+    db.session.execute(
+        update(Job).where(stale)
+        .values(status='pending', locked_by=None, run_after=now, last_error=lost)
+    )
+    db.session.commit()
+
+
+def claim_jobs(worker_id, limit):
+    """Mark up to ``limit`` due jobs as running for this worker and return
+    their ids. A job is only claimed when its row is still pending, so
+    several workers can poll the same table."""
+    now = datetime.utcnow()
+    candidates = db.session.scalars(
+        select(Job.id).where(Job.status == 'pending', Job.run_after <= now)
+        .order_by(Job.run_after, Job.id).limit(limit * 2)
+    ).all()
+    claimed = []
+    for job_id in candidates:
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'pending')
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    db.session.commit()
+    return claimed
+
+
+def run_job(app, job_id):
+    """Run one claimed job in its own app context (and so its own session)."""
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        handler = _handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for job kind {job.kind!r}')
+            payload = json.loads(job.payload)
+            expected = payload.pop('_volume', None)
+            if expected is not None and expected != volume_id(app):
+                # Removing or rendering files on another machine's empty folder
+                # would "succeed"; fail instead so it shows in /admin/jobs
+                raise VolumeMismatch(
+                    f'Worker does not see the UPLOAD_FOLDER this job was queued on '
+                    f'({os.path.abspath(app.config["UPLOAD_FOLDER"])}); run it on the same host or volume'
+                )
+            handler(**payload)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.last_error = traceback.format_exc()[-4000:]
+            job.locked_by = None
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+                app.logger.error(f'Job {job.id} ({job.kind}) failed after {job.attempts} attempts: {e}')
+            else:
+                delay = retry_delay(job.attempts, app.config.get('JOB_RETRY_BASE', 30), app.config.get('JOB_RETRY_MAX', 3600))
+                job.status = 'pending'
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                app.logger.warning(f'Job {job.id} ({job.kind}) attempt {job.attempts} failed, retrying in {delay:.0f}s: {e}')
+        else:
+            job.status = 'done'
+            job.locked_by = None
+            job.last_error = None
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return job.status
+
+
+def run_worker(app, workers=2, poll_interval=2.0, once=False, log=None):
+    """Poll the jobs table and run due jobs on a pool of ``workers`` threads
+    until interrupted, or until the queue is drained when ``once`` is set.
+    Returns the number of jobs run."""
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    lock_timeout = app.config.get('JOB_LOCK_TIMEOUT', 600)
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            with app.app_context():
+                requeue_stale(lock_timeout)
+                job_ids = claim_jobs(worker_id, workers)
+            if not job_ids:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+            statuses = list(pool.map(lambda job_id: run_job(app, job_id), job_ids))
+            processed += len(job_ids)
+            if log is not None:
+                log(f"{len(job_ids)} tugas dijalankan ({statuses.count('done')} selesai).")
+    return processed
+
+
+def init_jobs(app):
+    """With JOBS_IN_PROCESS, run one job thread inside each web process
+    instead of a separate `flask jobs-worker`. It starts with the first
+    request, i.e. only in processes that serve, and runs one job at a time
+    on the extra pool connection config.py sets aside for it."""
+    if not app.config.get('JOBS_IN_PROCESS') or app.testing:
+        return
+
+    @app.before_request
+    def _start_background_worker():
+        if _background_worker['pid'] == os.getpid():
+            return
+        _background_worker['pid'] = os.getpid() # once per process, also after a fork
+        thread = threading.Thread(
+            target=run_worker,
+            args=(app,),
+            kwargs={'workers': 1},
+            name='jobs-worker',
+            daemon=True,
+        )
+        thread.start()
+        app.logger.info(f'Background job worker started in process {os.getpid()}')
+
+
+def status_counts():
+    counts = dict(db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+    return {status: counts.get(status, 0) for status in STATUSES}
+
+
+def retry_job(job):
+    """Put a failed job back in the queue with a fresh set of attempts."""
+    job.status = 'pending'
+    job.attempts = 0
+    job.run_after = datetime.utcnow()
+    job.finished_at = None
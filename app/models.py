@@ -1,7 +1,11 @@
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from app.passwords import check_access_token_hash, hash_access_token, hash_password, needs_rehash
 from datetime import datetime, timedelta
+from sqlalchemy.dialects.mysql import MEDIUMBLOB, MEDIUMTEXT
+import secrets
+import zlib
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -23,50 +27,161 @@ class User(UserMixin, db.Model):
     surat_masuk_uploaded = db.relationship('SuratMasuk', backref='uploader', lazy=True)
     surat_keluar_uploaded = db.relationship('SuratKeluar', backref='uploader', lazy=True)
 
+    __table_args__ = (
+        # Member roster: WHERE role = 'anggota' ORDER BY nama_lengkap, id
+        db.Index('ix_users_role_nama_lengkap', 'role', 'nama_lengkap', 'id'),
+    )
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # Method and cost come from PASSWORD_HASH_METHOD (see app.passwords)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            # Upgrade hashes made with other settings while the plain password
+            # is at hand; the caller's commit stores it
+            self.set_password(password)
+        return True
 
     def set_access_token(self, token, expires_in_seconds=300): # Default 5 minutes
-        self.access_token_hash = generate_password_hash(token)
+        self.access_token_hash = hash_access_token(token)
         self.access_token_expiration = datetime.utcnow() + timedelta(seconds=expires_in_seconds)
         self.access_token_used = False
 
     def check_access_token(self, token):
         if not self.access_token_hash:
             return False
-        return check_password_hash(self.access_token_hash, token)
+        return check_access_token_hash(self.access_token_hash, token)
 
     def __repr__(self):
         return f'<User {self.username} - {self.role}>'
 
 class SuratMasuk(db.Model):
+    # Composite indexes for the list views: anggota lists are filtered by
+    # uploader, every list is ordered by (sort column, id) for keyset paging
+    __table_args__ = (
+        db.Index('ix_surat_masuk_owner_tanggal_terima', 'uploaded_by_user_id', 'tanggal_terima', 'id'),
+        db.Index('ix_surat_masuk_owner_asal_surat', 'uploaded_by_user_id', 'asal_surat', 'id'),
+        db.Index('ix_surat_masuk_owner_nomor_surat', 'uploaded_by_user_id', 'nomor_surat', 'id'),
+        db.Index('ix_surat_masuk_tanggal_terima', 'tanggal_terima', 'id'),
+        db.Index('ix_surat_masuk_asal_surat', 'asal_surat', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     nomor_surat = db.Column(db.String(100), unique=True, nullable=False)
     asal_surat = db.Column(db.String(100), nullable=False)
     tanggal_terima = db.Column(db.Date, nullable=False)
     perihal = db.Column(db.Text, nullable=False)
+    # Blob-backed rows keep the original file name here; legacy rows (no
+    # file_digest yet) the uuid-prefixed name in the per-kind upload folder
     file_path = db.Column(db.String(255), nullable=False)
+    file_digest = db.Column(db.String(64), db.ForeignKey('blobs.digest'), nullable=True, index=True)
     uploaded_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Relevance score, only populated by full-text searches (see app.search)
+    search_rank = db.query_expression()
+    # Truncated perihal, only populated by the list query (see app.queries.list_query)
+    perihal_ringkas = db.query_expression()
+
     def __repr__(self):
         return f'<SuratMasuk {self.nomor_surat}>'
 
 class SuratKeluar(db.Model):
+    # Composite indexes for the list views: anggota lists are filtered by
+    # uploader, every list is ordered by (sort column, id) for keyset paging
+    __table_args__ = (
+        db.Index('ix_surat_keluar_owner_tanggal_surat', 'uploaded_by_user_id', 'tanggal_surat', 'id'),
+        db.Index('ix_surat_keluar_owner_tujuan_surat', 'uploaded_by_user_id', 'tujuan_surat', 'id'),
+        db.Index('ix_surat_keluar_owner_nomor_surat', 'uploaded_by_user_id', 'nomor_surat', 'id'),
+        db.Index('ix_surat_keluar_tanggal_surat', 'tanggal_surat', 'id'),
+        db.Index('ix_surat_keluar_tujuan_surat', 'tujuan_surat', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     nomor_surat = db.Column(db.String(100), unique=True, nullable=False)
     tujuan_surat = db.Column(db.String(100), nullable=False)
     tanggal_surat = db.Column(db.Date, nullable=False)
     perihal = db.Column(db.Text, nullable=False)
+    # Blob-backed rows keep the original file name here; legacy rows (no
+    # file_digest yet) the uuid-prefixed name in the per-kind upload folder
     file_path = db.Column(db.String(255), nullable=False)
+    file_digest = db.Column(db.String(64), db.ForeignKey('blobs.digest'), nullable=True, index=True)
     uploaded_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Relevance score, only populated by full-text searches (see app.search)
+    search_rank = db.query_expression()
+    # Truncated perihal, only populated by the list query (see app.queries.list_query)
+    perihal_ringkas = db.query_expression()
+
     def __repr__(self):
         return f'<SuratKeluar {self.nomor_surat}>'
 
+class Blob(db.Model):
+    """A stored file, shared by every letter whose upload had the same content."""
+    __tablename__ = 'blobs'
+    digest = db.Column(db.String(64), primary_key=True) # SHA-256 of the content, hex
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0) # letters pointing at this blob
+    original_size = db.Column(db.BigInteger, nullable=True) # upload size before JPEG recompression, if any
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Random per row, so a digest deleted and stored again is a new generation
+    # to the job queue (see app.storage.blob_job_key); NULL on older rows
+    generation = db.Column(db.String(16), nullable=True, default=lambda: secrets.token_hex(8))
+
+    extracted_text = db.relationship('BlobText', uselist=False, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<Blob {self.digest[:12]} refs={self.ref_count}>'
+
+class BlobText(db.Model):
+    """Text extracted from a PDF/DOCX blob for content search (see app.extraction)."""
+    __tablename__ = 'blob_texts'
+    id = db.Column(db.Integer, primary_key=True) # integer rowid for the SQLite FTS5 index
+    digest = db.Column(db.String(64), db.ForeignKey('blobs.digest'), unique=True, nullable=False)
+    extractor_version = db.Column(db.Integer, nullable=False, default=1) # re-extract when app.extraction improves
+    char_count = db.Column(db.Integer, nullable=False, default=0)
+    content = db.Column(db.LargeBinary().with_variant(MEDIUMBLOB(), 'mysql'), nullable=True) # zlib-compressed UTF-8 text
+    # Distinct lower-case words of the text, in order of appearance; this is
+    # what the full-text indexes cover
+    search_text = db.Column(db.Text().with_variant(MEDIUMTEXT(), 'mysql'), nullable=True)
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def text(self):
+        return zlib.decompress(self.content).decode('utf-8') if self.content else ''
+
+    def __repr__(self):
+        return f'<BlobText {self.digest[:12]} chars={self.char_count}>'
+
+class Job(db.Model):
+    """A unit of background work, run by `flask jobs-worker` (see app.jobs)."""
+    __tablename__ = 'jobs'
+    # Workers poll for pending jobs that are due
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON keyword arguments for the handler
+    # Enqueueing twice with the same key yields the existing job
+    idempotency_key = db.Column(db.String(191), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'running', 'done' or 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
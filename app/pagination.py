@@ -0,0 +1,172 @@
+import base64
+import json
+import math
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    """One page of a keyset (seek) paginated list.
+
+    Exposes the attributes the list templates use (items, page, per_page,
+    has_prev, has_next) plus the cursors for the neighbouring pages.
+    """
+
+    def __init__(self, items, per_page, offset, total, has_prev, has_next, prev_cursor, next_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.offset = offset
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def page(self):
+        return self.offset // self.per_page + 1
+
+    @property
+    def pages(self):
+        # Page count is only known when a total was computed (or carried in the cursor)
+        if self.total is None:
+            return None
+        return max(1, math.ceil(self.total / self.per_page))
+
+
+def _dump_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, raw):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        # Types without a Python equivalent are compared as sent
+        return raw
+    if python_type is datetime:
+        return datetime.fromisoformat(raw)
+    if python_type is date:
+        return date.fromisoformat(raw)
+    return python_type(raw)
+
+
+def encode_cursor(sort_key, key, direction, offset, total):
+    # key is None for offset-only cursors (see keyset_paginate's ``seek``)
+    payload = {'s': sort_key, 'k': [_dump_value(key[0]), key[1]] if key else None, 'd': direction, 'o': offset, 't': total}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_key, sort_column):
+    """Return the decoded cursor state, or None if it is missing, malformed or
+    was issued for a different sort column/order."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload['s'] != sort_key or payload['d'] not in ('next', 'prev'):
+            return None
+        key = payload['k']
+        if key is not None:
+            value, last_id = key
+            key = (_load_value(sort_column, value), int(last_id))
+        total = payload.get('t')
+        return {
+            'key': key,
+            'direction': payload['d'],
+            'offset': max(int(payload.get('o', 0)), 0),
+            'total': int(total) if total is not None else None,
+        }
+    except Exception:
+        # The cursor comes from the query string: whatever is wrong with it
+        # (bad base64, bytes that are not UTF-8, an unexpected shape) means
+        # starting again from the first page, never a 500
+        return None
+
+
+def build_seek_query(query, sort_column, id_column, descending, after=None):
+    """Order ``query`` by (sort_column, id_column) and, if ``after`` holds a
+    (value, id) key, keep only the rows that come after it in that order."""
+    if after is not None:
+        value, last_id = after
+        if descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < last_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > last_id)))
+    if descending:
+        return query.order_by(sort_column.desc(), id_column.desc())
+    return query.order_by(sort_column.asc(), id_column.asc())
+
+
+def keyset_paginate(query, sort_column, id_column, sort_order='desc', cursor=None, page=None, per_page=10, count=True, key=None, total=None, seek=True):
+    """Paginate ``query`` by seeking on (sort_column, id_column).
+
+    Instead of ``OFFSET n`` every page is fetched with a
+    ``WHERE (col, id) < (last_col, last_id)`` predicate, so the cost of a page
+    does not grow with its depth. ``query`` must not be ordered yet.
+
+    The total row count is optional: when ``count`` is true it is computed
+    once on the first page and then carried along in the cursors, so it is
+    approximate for the rest of the walk. A ``total`` passed in by the caller
+    (e.g. from a count cache) takes precedence. ``page`` is accepted for old
+    ``?page=N`` links and falls back to a single OFFSET scan.
+
+    ``key`` names the row attribute holding the sort value when
+    ``sort_column`` is an expression rather than a mapped column.
+
+    With ``seek`` off the cursors carry only the offset and pages are fetched
+    with OFFSET, for sort values too long to put in a URL (and then not
+    loaded at all).
+    """
+    key = key or sort_column.key
+    sort_key = f'{key}:{sort_order}'
+    state = decode_cursor(cursor, sort_key, sort_column)
+    if seek and state is not None and state['key'] is None:
+        state = None
+    descending = sort_order == 'desc'
+    backwards = seek and state is not None and state['direction'] == 'prev'
+    # Walking backwards scans in the opposite order and flips the rows afterwards
+    scan_desc = descending != backwards
+
+    if total is None and state:
+        total = state['total']
+    if total is None and count:
+        total = query.order_by(None).count()
+
+    offset = state['offset'] if state else 0
+    seek_query = build_seek_query(query, sort_column, id_column, scan_desc, state['key'] if state and seek else None)
+
+    if state is None and page and page > 1:
+        offset = (page - 1) * per_page
+        seek_query = seek_query.offset(offset)
+    elif not seek and offset:
+        seek_query = seek_query.offset(offset)
+
+    rows = seek_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        if not has_more:
+            # Reached the start of the list; serve a full first page instead of a short one
+            return keyset_paginate(query, sort_column, id_column, sort_order, per_page=per_page, count=count, key=key, total=total)
+        rows.reverse()
+        has_prev, has_next = True, True
+    else:
+        has_prev, has_next = offset > 0, has_more
+
+    prev_cursor = next_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_prev:
+            prev_key = (getattr(first, key), first.id) if seek else None
+            prev_cursor = encode_cursor(sort_key, prev_key, 'prev', max(offset - per_page, 0), total)
+        if has_next:
+            next_key = (getattr(last, key), last.id) if seek else None
+            next_cursor = encode_cursor(sort_key, next_key, 'next', offset + len(rows), total)
+
+    return KeysetPage(rows, per_page, offset, total, has_prev, has_next, prev_cursor, next_cursor)
@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import secrets
+import statistics
+import time
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Werkzeug's own default, and what every existing hash was made with
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+# Settings compared by `flask password-benchmark` when none are given
+BENCHMARK_METHODS = [
+    'scrypt:32768:8:1',
+    'scrypt:16384:8:1',
+    'scrypt:8192:8:1',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:260000',
+]
+
+
+def normalize_method(method):
+    """Spell out the defaults Werkzeug fills in, so a configured method
+    compares equal to the prefix of the hashes it produces."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = (list(args) + ['32768', '8', '1'][len(args):])[:3]
+        return f'scrypt:{int(n)}:{int(r)}:{int(p)}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f'Unknown PASSWORD_HASH_METHOD: {method}')
+
+
+def configured_method():
+    method = current_app.config.get('PASSWORD_HASH_METHOD') if has_app_context() else None
+    return normalize_method(method or DEFAULT_METHOD)
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=configured_method())
+
+
+def needs_rehash(password_hash):
+    """True when ``password_hash`` was made with other settings than the
+    configured ones (stronger or weaker)."""
+    return password_hash.split('$', 1)[0] != configured_method()
+
+
+# Prefix of access token hashes made by hash_access_token. Anything else in
+# users.access_token_hash is a Werkzeug KDF hash from before, still accepted.
+TOKEN_PREFIX = 'hmac-sha256:v1'
+
+
+def _token_key():
+    # Derived rather than SECRET_KEY itself, so the same key never signs
+    # both sessions and tokens
+    secret = current_app.config['SECRET_KEY']
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, b'mapascal access token', hashlib.sha256).digest()
+
+
+def _token_mac(key, salt, token):
+    return hmac.new(key, f'{salt}${token}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def hash_access_token(token):
+    """Keyed HMAC-SHA256 of a one-time access token. A KDF buys nothing for
+    a random, short-lived code, and without SECRET_KEY a leaked hash cannot
+    be brute-forced offline."""
+    salt = secrets.token_hex(8)
+    return f'{TOKEN_PREFIX}${salt}${_token_mac(_token_key(), salt, token)}'
+
+
+def check_access_token_hash(token_hash, token):
+    if not token_hash.startswith(TOKEN_PREFIX + '$'):
+        return check_password_hash(token_hash, token)
+    try:
+        _, salt, mac = token_hash.split('$')
+    except ValueError:
+        return False
+    return hmac.compare_digest(mac, _token_mac(_token_key(), salt, token))
+
+
+def benchmark(method, rounds=20):
+    """Time hashing and verifying with ``method`` on one core. Returns a dict
+    with median milliseconds per hash and per verify, and the logins per
+    second a single core sustains on verification alone."""
+    method = normalize_method(method)
+    password = 'benchmark-password-123'
+    hash_times = []
+    verify_times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        password_hash = generate_password_hash(password, method=method)
+        hash_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        check_password_hash(password_hash, password)
+        verify_times.append(time.perf_counter() - start)
+    verify_ms = statistics.median(verify_times) * 1000
+    return {
+        'method': method,
+        'hash_ms': statistics.median(hash_times) * 1000,
+        'verify_ms': verify_ms,
+        'logins_per_core': 1000 / verify_ms if verify_ms else float('inf'),
+    }
+
+
+def benchmark_access_token(rounds=1000):
+    """Median microseconds per access token check, for the KDF hashes
+    tokens used to be stored with and for the HMAC scheme."""
+    token = secrets.token_hex(6)
+    results = {}
+    for name, token_hash, count in [
+        ('werkzeug default (legacy)', generate_password_hash(token), min(rounds, 20)),
+        (TOKEN_PREFIX, hash_access_token(token), rounds),
+    ]:
+        times = []
+        for _ in range(count):
+            start = time.perf_counter()
+            check_access_token_hash(token_hash, token)
+            times.append(time.perf_counter() - start)
+        results[name] = statistics.median(times) * 1000000
+    return results
@@ -0,0 +1,176 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import zipfile
+from flask import current_app
+from app import db
+from app.jobs import job_handler
+from app.models import Blob
+from app.storage import get_blob_store
+from app.utils import ProcessPool
+
+try:
+    from PIL import Image
+except ImportError: # Pillow is optional; without it only PDFs get previews (via pdftoppm)
+    Image = None
+
+# Rendered variants, stored next to the blob as <digest>.<variant>
+THUMBNAIL = 'thumb.jpg'
+PREVIEW = 'preview.jpg'
+VARIANTS = (THUMBNAIL, PREVIEW)
+
+PDF_MIME = 'application/pdf'
+JPEG_MIME = 'image/jpeg'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+_pool = ProcessPool()
+_pending = set()
+_unrenderable = set() # digests whose render produced nothing; retried only with force
+_lock = threading.Lock()
+
+
+class RendererMissing(RuntimeError):
+    """A tool previews need is not installed; the job fails and is retried."""
+
+
+def _save_jpeg(image, target, size, quality):
+    image = image.convert('RGB')
+    image.thumbnail((size, size))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as out:
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp_path, target)
+
+
+def _pdf_first_page(source, size, target):
+    """Rasterise page one of a PDF to ``target`` with poppler's pdftoppm."""
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        raise RendererMissing('pdftoppm not found; install poppler-utils for PDF previews')
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(target)) as workdir:
+        prefix = os.path.join(workdir, 'page')
+        result = subprocess.run(
+            [pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(size), source, prefix],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60,
+        )
+        if result.returncode != 0 or not os.path.exists(prefix + '.jpg'):
+            return False
+        os.replace(prefix + '.jpg', target)
+    return True
+
+
+def render_previews(source, mime_type, thumb_path, preview_path, thumb_size, preview_size):
+    """Render a thumbnail and a low-resolution preview of ``source``.
+
+    Runs in a worker process, so it only deals with paths. Returns True when
+    both files were written.
+    """
+    if mime_type == PDF_MIME:
+        if not _pdf_first_page(source, preview_size, preview_path):
+            return False
+        if Image is None:
+            return _pdf_first_page(source, thumb_size, thumb_path)
+        with Image.open(preview_path) as image:
+            _save_jpeg(image, thumb_path, thumb_size, 70)
+        return True
+    if Image is None:
+        return False
+    if mime_type == JPEG_MIME:
+        with Image.open(source) as image:
+            # Let the JPEG decoder downscale while decoding instead of after
+            image.draft('RGB', (preview_size, preview_size))
+            _save_jpeg(image, preview_path, preview_size, 80)
+            _save_jpeg(image, thumb_path, thumb_size, 70)
+        return True
+    if mime_type == DOCX_MIME:
+        # Word stores a first-page thumbnail when "save preview picture" is on
+        with zipfile.ZipFile(source) as docx:
+            names = [name for name in docx.namelist() if name.startswith('docProps/thumbnail.')]
+            if not names:
+                return False
+            data = docx.read(names[0])
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+                _save_jpeg(image, preview_path, preview_size, 80)
+                _save_jpeg(image, thumb_path, thumb_size, 70)
+        except OSError:
+            return False # e.g. a WMF thumbnail Pillow cannot draw
+        return True
+    return False
+
+
+def check_renderer(app):
+    """Warn at startup when PDF previews cannot be rendered on this host."""
+    if app.config.get('PREVIEW_WORKERS', 2) > 0 and shutil.which('pdftoppm') is None:
+        app.logger.warning('pdftoppm (poppler-utils) is not installed: PDF preview jobs will fail '
+                           'until it is (see /admin/jobs)')
+
+
+def previews_ready(store, digest):
+    return all(os.path.exists(store.derived_path(digest, variant)) for variant in VARIANTS)
+
+
+def _render_args(app, store, digest, mime_type):
+    return (
+        os.path.join(store.root, store.locate(digest)),
+        mime_type,
+        store.derived_path(digest, THUMBNAIL),
+        store.derived_path(digest, PREVIEW),
+        app.config.get('PREVIEW_THUMB_SIZE', 240),
+        app.config.get('PREVIEW_SIZE', 1024),
+    )
+
+
+def schedule_previews(digest, mime_type, force=False):
+    """Queue rendering of a blob's previews in the process pool, unless they
+    exist already. Returns the Future, or None when nothing was queued.
+
+    Previews are keyed by content digest, so they only ever need rendering
+    once per distinct file.
+    """
+    app = current_app._get_current_object()
+    store = get_blob_store()
+    if not force and previews_ready(store, digest):
+        return None
+    with _lock:
+        if digest in _pending or (digest in _unrenderable and not force):
+            return None
+        _pending.add(digest)
+        _unrenderable.discard(digest)
+    args = _render_args(app, store, digest, mime_type)
+    # Blobs still waiting for `flask storage-reshard` have no shard directory yet
+    os.makedirs(os.path.dirname(args[2]), exist_ok=True)
+    try:
+        future = _pool.submit(app.config.get('PREVIEW_WORKERS', 2), render_previews, *args)
+    except Exception:
+        with _lock:
+            _pending.discard(digest)
+        raise
+
+    def done(future):
+        with _lock:
+            _pending.discard(digest)
+            # An error is retried by the job; only a file with nothing to show is final
+            if future.exception() is None and not future.result():
+                _unrenderable.add(digest)
+        if future.exception() is not None:
+            app.logger.warning(f'Preview rendering failed for blob {digest[:12]}: {future.exception()}')
+
+    future.add_done_callback(done)
+    return future
+
+
+@job_handler('previews.render')
+def _render_blob_previews(digest):
+    # Queued by app.storage.add_reference for every new blob; runs in the job
+    # worker, which waits on the process pool so a crash gets retried
+    blob = db.session.get(Blob, digest)
+    if blob is None or current_app.config.get('PREVIEW_WORKERS', 2) <= 0:
+        return
+    future = schedule_previews(digest, blob.mime_type)
+    if future is not None:
+        future.result()
@@ -0,0 +1,203 @@
+from flask import request, flash, g, has_request_context
+from flask_login import current_user
+from sqlalchemy import case, event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, load_only, with_expression
+from datetime import datetime
+from app import db
+from app.models import SuratMasuk, SuratKeluar, User
+from app.search import get_search_backend
+
+# search_by value that searches all text fields at once
+SEARCH_ALL = 'semua'
+# search_by value that searches the text extracted from the letter's file
+SEARCH_CONTENT = 'isi'
+# sort_by value that orders search results by relevance
+SORT_RELEVANCE = 'relevansi'
+
+# Characters of perihal shown in the list tables
+PERIHAL_PREVIEW_LENGTH = 150
+
+
+class LetterListSpec:
+    """Describes the whitelisted search/sort columns of one letter list."""
+
+    def __init__(self, model, party_field, date_field, party_label, date_label):
+        self.model = model
+        self.party_field = party_field # asal_surat / tujuan_surat
+        self.date_field = date_field # tanggal_terima / tanggal_surat
+        self.party_label = party_label
+        self.date_label = date_label
+        self.text_fields = ['nomor_surat', party_field, 'perihal']
+        self.search_fields = self.text_fields + [SEARCH_ALL, SEARCH_CONTENT]
+        self.sort_fields = ['nomor_surat', party_field, date_field, 'perihal']
+        # TEXT columns, too long to carry in a keyset cursor: paged by OFFSET
+        self.offset_sort_fields = ['perihal']
+        self.default_search_by = 'nomor_surat'
+        self.default_sort_by = date_field
+        self.default_sort_order = 'desc'
+
+
+def list_query(spec):
+    """Base query for the list tables.
+
+    Loads only the columns the table renders, the uploader's name through a
+    single JOIN, and a truncated perihal computed by the database instead of
+    the full TEXT value (also when sorting by it, see ListFilter.seek).
+    """
+    model = spec.model
+    columns = [model.id, model.nomor_surat, getattr(model, spec.party_field),
+               getattr(model, spec.date_field), model.uploaded_by_user_id]
+    preview = case(
+        (func.substr(model.perihal, PERIHAL_PREVIEW_LENGTH + 1, 1) != '',
+         func.substr(model.perihal, 1, PERIHAL_PREVIEW_LENGTH) + '…'),
+        else_=model.perihal,
+    )
+    return model.query.options(
+        load_only(*columns),
+        joinedload(model.uploader, innerjoin=True).load_only(User.id, User.nama_lengkap),
+        with_expression(model.perihal_ringkas, preview),
+    )
+
+
+# Columns the member lists show; password and token hashes stay in the database
+ROSTER_COLUMNS = (User.id, User.nama_lengkap, User.nia, User.jenjang_keanggotaan, User.nama_lapangan, User.is_active)
+
+
+def roster_query():
+    """Projected, unordered query of all anggota, served by ix_users_role_nama_lengkap."""
+    return db.session.query(*ROSTER_COLUMNS).filter(User.role == 'anggota')
+
+
+SURAT_MASUK_LIST = LetterListSpec(SuratMasuk, 'asal_surat', 'tanggal_terima', 'Asal Surat', 'Tanggal Terima')
+SURAT_KELUAR_LIST = LetterListSpec(SuratKeluar, 'tujuan_surat', 'tanggal_surat', 'Tujuan Surat', 'Tanggal Surat')
+
+
+class ListFilter:
+    """Validated list-view parameters (search, date range, sort, owner)."""
+
+    def __init__(self, spec, search_query='', search_by=None, start_date=None, end_date=None,
+                 sort_by=None, sort_order=None, owner_id=None, start_date_str='', end_date_str=''):
+        self.spec = spec
+        self.search_query = search_query.strip()
+        self.search_by = search_by if search_by in spec.search_fields else spec.default_search_by
+        self.start_date = start_date
+        self.end_date = end_date
+        if sort_by is None and self.search_query:
+            # Searches are ranked by relevance unless a column sort was picked
+            sort_by = SORT_RELEVANCE
+        if sort_by == SORT_RELEVANCE and not self.search_query:
+            sort_by = None
+        self.sort_by = sort_by if sort_by in spec.sort_fields or sort_by == SORT_RELEVANCE else spec.default_sort_by
+        self.sort_order = sort_order if sort_order in ('asc', 'desc') else spec.default_sort_order
+        self.owner_id = owner_id
+        # Raw strings are kept so the form and the pagination links echo what the user typed
+        self.start_date_str = start_date_str
+        self.end_date_str = end_date_str
+        self.rank_column = None
+
+    @classmethod
+    def from_request(cls, spec, args=None):
+        args = request.args if args is None else args
+        start_date_str = args.get('start_date', '', type=str)
+        end_date_str = args.get('end_date', '', type=str)
+
+        start_date = end_date = None
+        if start_date_str:
+            try:
+                start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            except ValueError:
+                flash('Format tanggal mulai tidak valid.', 'warning')
+        if end_date_str:
+            try:
+                end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            except ValueError:
+                flash('Format tanggal akhir tidak valid.', 'warning')
+
+        # Anggota only ever see the letters they uploaded
+        owner_id = current_user.id if current_user.role == 'anggota' else None
+
+        return cls(
+            spec,
+            search_query=args.get('search', '', type=str),
+            search_by=args.get('search_by', spec.default_search_by, type=str),
+            start_date=start_date,
+            end_date=end_date,
+            sort_by=args.get('sort_by', None, type=str),
+            sort_order=args.get('sort_order', spec.default_sort_order, type=str),
+            owner_id=owner_id,
+            start_date_str=start_date_str,
+            end_date_str=end_date_str,
+        )
+
+    @property
+    def sort_column(self):
+        if self.sort_by == SORT_RELEVANCE:
+            return self.rank_column
+        return getattr(self.spec.model, self.sort_by)
+
+    @property
+    def seek(self):
+        """False when the sort column is too long for a keyset cursor."""
+        return self.sort_by not in self.spec.offset_sort_fields
+
+    @property
+    def sort_key(self):
+        """Row attribute holding the value of the sort column."""
+        return 'search_rank' if self.sort_by == SORT_RELEVANCE else self.sort_by
+
+    def apply(self, query, with_rank=True):
+        """Apply the owner, search and date filters (but not the ordering).
+
+        With ``with_rank`` the relevance score is loaded into
+        ``search_rank``; queries over plain columns must turn it off. A
+        relevance sort falls back to the default sort only when the backend
+        cannot rank the search, which sets ``sort_by`` accordingly.
+        """
+        model = self.spec.model
+        if self.owner_id is not None:
+            query = query.filter(model.uploaded_by_user_id == self.owner_id)
+        if self.search_query:
+            backend = get_search_backend()
+            if self.search_by == SEARCH_CONTENT:
+                query, self.rank_column = backend.apply_content(query, self.spec, self.search_query)
+            else:
+                fields = self.spec.text_fields if self.search_by == SEARCH_ALL else [self.search_by]
+                query, self.rank_column = backend.apply(query, self.spec, fields, self.search_query)
+            if self.rank_column is None:
+                if self.sort_by == SORT_RELEVANCE:
+                    # The backend could not rank this search (e.g. LIKE fallback)
+                    self.sort_by = self.spec.default_sort_by
+            elif with_rank:
+                query = query.options(with_expression(model.search_rank, self.rank_column))
+            # Without with_rank a relevance sort still orders by rank_column
+            # (see sort_column), so exports follow the list order
+        date_column = getattr(model, self.spec.date_field)
+        if self.start_date:
+            query = query.filter(date_column >= self.start_date)
+        if self.end_date:
+            query = query.filter(date_column <= self.end_date)
+        return query
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.db_query_count = g.get('db_query_count', 0) + 1
+
+
+def get_query_count():
+    """Number of SQL statements issued so far by the current request."""
+    return g.get('db_query_count', 0)
+
+
+def init_query_counter(app):
+    """Count SQL statements per request and, if QUERY_COUNT_HEADER is on,
+    report them in an X-Query-Count response header."""
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['X-Query-Count'] = str(get_query_count())
+        return response
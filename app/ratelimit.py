@@ -0,0 +1,222 @@
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from math import floor
+from limits.storage import SlidingWindowCounterSupport, Storage, storage_from_string
+from app.utils import LocalSQLite
+
+# Expired counters are deleted at most this often (seconds) per process
+SWEEP_INTERVAL = 60
+
+# Failed logins are counted per account over this many seconds
+FAILED_LOGIN_WINDOW = 900
+
+_SCHEMA = [
+    # One row per limit key. Sliding-window rows keep the count of the
+    # window they were last hit in and of the window before it, so a check
+    # is one primary key lookup and one write however busy the key is.
+    """CREATE TABLE IF NOT EXISTS counters (
+        key TEXT PRIMARY KEY,
+        window INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        previous INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS ix_counters_expires_at ON counters (expires_at)',
+]
+
+_UPSERT = """INSERT INTO counters (key, window, count, previous, expires_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET window = excluded.window, count = excluded.count,
+    previous = excluded.previous, expires_at = excluded.expires_at"""
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport):
+    """Rate limit counters in a local SQLite file in WAL mode, shared by every
+    gunicorn worker on the host and kept across restarts. Single host only:
+    other hosts or containers each count on their own file, so use redis://
+    there.
+
+    Configured as e.g. ``'sqlite:////var/lib/mapascal/ratelimit.db'``
+    (absolute, four slashes), outside the code tree so a redeploy keeps it.
+    Hits run in a BEGIN IMMEDIATE transaction, so concurrent workers never
+    both take the last slot; plain reads do not lock. Works with the
+    fixed-window and sliding-window-counter strategies.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5.0, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.db = LocalSQLite(uri, _SCHEMA, timeout)
+        self._last_sweep = 0.0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        return self.db.connection()
+
+    @contextmanager
+    def _write(self):
+        with self.db.write() as connection:
+            yield connection
+        self._sweep(connection)
+
+    def _sweep(self, connection):
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        connection.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+
+    def _row(self, connection, key):
+        return connection.execute(
+            'SELECT window, count, previous, expires_at FROM counters WHERE key = ?', (key,)
+        ).fetchone()
+
+    # Fixed window
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._write() as connection:
+            row = self._row(connection, key)
+            if row is None or row[3] <= now:
+                count, expires_at = amount, now + expiry
+            else:
+                count, expires_at = row[1] + amount, row[3]
+            connection.execute(_UPSERT, (key, 0, count, 0, expires_at))
+        return count
+
+    def get(self, key):
+        row = self._row(self._connection(), key)
+        return row[1] if row and row[3] > time.time() else 0
+
+    def get_expiry(self, key):
+        row = self._row(self._connection(), key)
+        return row[3] if row and row[3] > time.time() else time.time()
+
+    def clear(self, key):
+        with self._write() as connection:
+            connection.execute('DELETE FROM counters WHERE key = ?', (key,))
+
+    def reset(self):
+        with self._write() as connection:
+            return connection.execute('DELETE FROM counters').rowcount
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    # Sliding window counter
+
+    @staticmethod
+    def _window_counts(row, window):
+        """(previous, current) counts as of ``window``, shifting the stored
+        pair along when the row was last hit one or more windows ago."""
+        if row is None:
+            return 0, 0
+        stored_window, count, previous = row[0], row[1], row[2]
+        if stored_window == window:
+            return previous, count
+        if stored_window == window - 1:
+            return count, 0
+        return 0, 0
+
+    @staticmethod
+    def _window_info(previous, current, expiry, now):
+        # Same weighting as limits' own storages
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous, previous_ttl, current, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        window = int(now / expiry)
+        with self._write() as connection:
+            previous, current = self._window_counts(self._row(connection, key), window)
+            _, previous_ttl, _, _ = self._window_info(previous, current, expiry, now)
+            if floor(previous * previous_ttl / expiry + current) + amount > limit:
+                return False
+            # Both counts are stale once the window after this one is over
+            connection.execute(_UPSERT, (key, window, current + amount, previous, (window + 2) * expiry))
+        return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous, current = self._window_counts(self._row(self._connection(), key), int(now / expiry))
+        return self._window_info(previous, current, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        self.clear(key)
+
+
+class FailedLogins:
+    """Failed login attempts per account over FAILED_LOGIN_WINDOW seconds.
+
+    Kept in its own storage built from RATELIMIT_STORAGE_URI (so it works
+    with rate limiting switched off): shared by all workers with the SQLite
+    default, and bounded, since each account is one row that expires.
+    """
+
+    def __init__(self):
+        self.storage = None
+
+    def init_app(self, app):
+        self.storage = storage_from_string(app.config.get('RATELIMIT_STORAGE_URI', 'memory://'))
+
+    @staticmethod
+    def _key(role, identifier):
+        # Identifiers are user input; cap the key length
+        return f'failed-login/{role}/{identifier[:64].lower()}'
+
+    def record(self, role, identifier):
+        """Count a failure and return the failures within the window."""
+        return self.storage.incr(self._key(role, identifier), FAILED_LOGIN_WINDOW)
+
+    def clear(self, role, identifier):
+        self.storage.clear(self._key(role, identifier))
+
+
+failed_logins = FailedLogins()
+
+
+def _benchmark_worker(uri, checks, keys, seed):
+    # Runs in its own process, like a gunicorn worker
+    storage = SQLiteStorage(uri)
+    latencies = []
+    for i in range(checks):
+        key = f'LIMITER/bench/{(seed + i) % keys}'
+        start = time.perf_counter()
+        storage.acquire_sliding_window_entry(key, 1000000, 60)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def benchmark(uri, workers, checks, keys):
+    """Run ``checks`` hits in each of ``workers`` processes at once against
+    the storage at ``uri``. Returns throughput and latency percentiles (µs)."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # Warm the pool up so process start-up is not timed
+        list(pool.map(_benchmark_worker, [uri] * workers, [1] * workers, [keys] * workers, range(workers)))
+        start = time.perf_counter()
+        futures = [pool.submit(_benchmark_worker, uri, checks, keys, seed * checks) for seed in range(workers)]
+        latencies = sorted(latency for future in futures for latency in future.result())
+        elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'workers': workers,
+        'checks_per_second': len(latencies) / elapsed,
+        'p50': quantiles[49] * 1000000,
+        'p95': quantiles[94] * 1000000,
+        'p99': quantiles[98] * 1000000,
+    }
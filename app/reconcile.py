@@ -0,0 +1,267 @@
+import heapq
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from sqlalchemy import select
+from app import db
+from app.jobs import VOLUME_MARKER
+from app.models import Blob
+from app.storage import DIGEST_RE
+from app.utils import Throttle
+
+# Items held in memory per sorted run before it is spilled to a temp file
+SORT_CHUNK_SIZE = 100000
+
+QUARANTINE_DIR = '.quarantine'
+
+# Top-level entries of the uploads folder the reconciler knows about
+BLOB_AREA = 'blobs'
+
+
+class Finding:
+    """One inconsistency between the uploads folder and the database.
+
+    kind is 'orphan' (a file no row points at), 'dangling' (a row whose
+    file is missing) or 'unknown' (an entry the reconciler does not manage
+    and leaves alone). ``moved_to`` is set once an orphan was quarantined.
+    """
+
+    def __init__(self, kind, area, path, detail=''):
+        self.kind = kind
+        self.area = area
+        self.path = path
+        self.detail = detail
+        self.moved_to = None
+
+    def __str__(self):
+        text = f'[{self.kind}] {self.area}/{self.path}'
+        if self.detail:
+            text += f' ({self.detail})'
+        if self.moved_to:
+            text += f' -> {self.moved_to}'
+        return text
+
+
+def _spill(items):
+    run = tempfile.TemporaryFile('w+', encoding='utf-8')
+    for item in items:
+        # JSON survives file names with newlines or odd characters
+        run.write(json.dumps(item) + '\n')
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    for line in run:
+        yield tuple(json.loads(line))
+
+
+def external_sort(items, chunk_size=SORT_CHUNK_SIZE):
+    """Sort an iterable of tuples that may not fit in memory: sorted runs of
+    ``chunk_size`` are spilled to temp files and merged back lazily."""
+    runs = []
+    chunk = []
+    try:
+        for item in items:
+            chunk.append(tuple(item))
+            if len(chunk) >= chunk_size:
+                runs.append(_spill(sorted(chunk)))
+                chunk = []
+        if not runs:
+            yield from sorted(chunk)
+            return
+        if chunk:
+            runs.append(_spill(sorted(chunk)))
+            chunk = []
+        yield from heapq.merge(*[_read_run(run) for run in runs])
+    finally:
+        for run in runs:
+            run.close()
+
+
+def merge_join(files, rows):
+    """Walk two streams of (key, ...) tuples, both sorted by key, and yield
+    (key, file items, row items) for every key on either side."""
+    files = groupby(files, key=itemgetter(0))
+    rows = groupby(rows, key=itemgetter(0))
+    file_group = next(files, None)
+    row_group = next(rows, None)
+    while file_group is not None or row_group is not None:
+        if row_group is None or (file_group is not None and file_group[0] < row_group[0]):
+            yield file_group[0], list(file_group[1]), []
+            file_group = next(files, None)
+        elif file_group is None or row_group[0] < file_group[0]:
+            yield row_group[0], [], list(row_group[1])
+            row_group = next(rows, None)
+        else:
+            yield file_group[0], list(file_group[1]), list(row_group[1])
+            file_group = next(files, None)
+            row_group = next(rows, None)
+
+
+def _blob_key(name):
+    """Digest a blob-store file belongs to ('<digest>' or '<digest>.<variant>'),
+    or '' for anything else, e.g. a temp file left by a crashed write."""
+    digest = name[:64]
+    if DIGEST_RE.match(digest) and (len(name) == 64 or name[64] == '.'):
+        return digest
+    return ''
+
+
+def iter_blob_files(root, throttle):
+    """Yield (digest key, relative path, is the blob itself) for every file in
+    the blob store: sharded and flat blobs, their derived previews, and
+    leftovers in .tmp and the shard directories."""
+    with os.scandir(root) as top:
+        for entry in top:
+            throttle.wait()
+            if entry.is_file():
+                yield _blob_key(entry.name), entry.name, entry.name == _blob_key(entry.name)
+            elif entry.is_dir() and (entry.name == '.tmp' or len(entry.name) == 2):
+                yield from _iter_shard(root, entry.path, throttle)
+
+
+def _iter_shard(root, path, throttle):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            throttle.wait()
+            if entry.is_dir():
+                if len(entry.name) == 2:
+                    yield from _iter_shard(root, entry.path, throttle)
+                continue
+            relative = os.path.relpath(entry.path, root)
+            yield _blob_key(entry.name), relative, entry.name == _blob_key(entry.name)
+
+
+def iter_blob_rows(batch_size):
+    """Every Blob digest, in primary key order, one batch per round trip."""
+    last = ''
+    while True:
+        digests = db.session.scalars(
+            select(Blob.digest).where(Blob.digest > last).order_by(Blob.digest).limit(batch_size)
+        ).all()
+        if not digests:
+            return
+        for digest in digests:
+            yield (digest,)
+        last = digests[-1]
+        db.session.rollback() # end the read transaction between batches
+
+
+def iter_legacy_rows(model, batch_size):
+    """(file_path, id) of every letter still using a legacy file, read in
+    id-ordered batches."""
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(model.id, model.file_path)
+            .where(model.file_digest.is_(None), model.id > last_id)
+            .order_by(model.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        for row_id, file_path in rows:
+            yield (file_path, row_id)
+        last_id = rows[-1][0]
+        db.session.rollback()
+
+
+def iter_legacy_files(folder, throttle):
+    if not os.path.isdir(folder):
+        return
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            throttle.wait()
+            if entry.is_file():
+                yield (entry.name,)
+
+
+class Reconciler:
+    """Compares the uploads folder with the database and quarantines orphans.
+
+    Both sides are streamed: directories with os.scandir, rows in batches.
+    Whatever is not already in key order goes through external_sort, and a
+    merge join pairs them up, so memory does not grow with the number of
+    files. Files younger than ``grace`` seconds are never called orphans,
+    since an upload writes its file before its row commits.
+    """
+
+    def __init__(self, upload_root, blob_root, legacy_areas, dry_run=False, rate=None,
+                 grace=3600, batch_size=1000):
+        self.upload_root = upload_root
+        self.blob_root = blob_root
+        self.legacy_areas = legacy_areas # {area name: (model, folder)}
+        self.dry_run = dry_run
+        self.throttle = Throttle(rate)
+        self.grace = grace
+        self.batch_size = batch_size
+        self.quarantine_root = os.path.join(upload_root, QUARANTINE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S'))
+        self.started = time.time()
+
+    def run(self):
+        """Yield a Finding per inconsistency, quarantining orphans as it goes
+        unless this is a dry run."""
+        yield from self._unknown_entries()
+        yield from self._reconcile_blobs()
+        for area, (model, folder) in self.legacy_areas.items():
+            yield from self._reconcile_legacy(area, model, folder)
+
+    def _unknown_entries(self):
+        known = {QUARANTINE_DIR, VOLUME_MARKER, os.path.basename(self.blob_root)}
+        known.update(os.path.basename(folder) for _, folder in self.legacy_areas.values())
+        if not os.path.isdir(self.upload_root):
+            return
+        with os.scandir(self.upload_root) as entries:
+            for entry in entries:
+                if entry.name not in known:
+                    yield Finding('unknown', '.', entry.name, 'dibiarkan')
+
+    def _is_settled(self, path):
+        try:
+            return os.stat(path).st_mtime < self.started - self.grace
+        except FileNotFoundError:
+            return False
+
+    def _quarantine(self, finding, source):
+        if self.dry_run:
+            return finding
+        target = os.path.join(self.quarantine_root, finding.area, finding.path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self.throttle.wait()
+        os.replace(source, target)
+        finding.moved_to = os.path.relpath(target, self.upload_root)
+        return finding
+
+    def _reconcile_blobs(self):
+        if not os.path.isdir(self.blob_root):
+            return
+        files = external_sort(iter_blob_files(self.blob_root, self.throttle))
+        for digest, file_items, row_items in merge_join(files, iter_blob_rows(self.batch_size)):
+            if row_items:
+                if not any(is_blob for _, _, is_blob in file_items):
+                    yield Finding('dangling', BLOB_AREA, digest, 'baris blobs tanpa file')
+                continue
+            # A row committed after the DB stream passed this digest (the
+            # upload found the file already there) must keep its file
+            if digest and db.session.get(Blob, digest) is not None:
+                continue
+            for _, relative, _ in file_items:
+                source = os.path.join(self.blob_root, relative)
+                if self._is_settled(source):
+                    yield self._quarantine(Finding('orphan', BLOB_AREA, relative), source)
+
+    def _reconcile_legacy(self, area, model, folder):
+        files = external_sort(iter_legacy_files(folder, self.throttle))
+        rows = external_sort(iter_legacy_rows(model, self.batch_size))
+        for file_path, file_items, row_items in merge_join(files, rows):
+            if row_items and not file_items:
+                ids = ', '.join(str(row_id) for _, row_id in row_items)
+                yield Finding('dangling', area, file_path, f'{model.__tablename__} ID {ids}')
+            elif file_items and not row_items:
+                source = os.path.join(folder, file_path)
+                if self._is_settled(source):
+                    yield self._quarantine(Finding('orphan', area, file_path), source)
@@ -1,14 +1,21 @@
 
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, session
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, request, current_app, session, jsonify
 import secrets
 from datetime import datetime # Added for token expiration check
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy import or_
 from app import db, limiter
-from app.models import User
+from app.models import User, Job
+from app.cache import count_cache, directory_cache, user_cache
 from app.forms import LoginForm, RegistrationForm, TokenVerificationForm
 from app.decorators import requires_role
+from app.export import iter_csv
+from app.pagination import keyset_paginate
+from app.queries import roster_query
+from app.jobs import STATUSES, retry_job, status_counts
+from app.ratelimit import failed_logins
+from app.sessions import rotate_session
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -42,23 +49,22 @@ def login():
             ).first()
             if user and user.check_password(form.password.data):
                 # Reset failed login attempts on successful login
-                session.pop('failed_login_attempts', None)
+                failed_logins.clear(role, identifier)
                 if not user.is_active:
                     user.is_active = True
-                    db.session.commit()
+                # Also stores a rehashed password, if check_password upgraded it
+                db.session.commit()
+                rotate_session()
                 login_user(user)
                 current_app.logger.info(f"Admin user {user.username} logged in successfully from {request.remote_addr}")
                 flash(f'Login berhasil! Selamat datang, {user.nama_lengkap}.', 'success')
                 return redirect(url_for('auth.dashboard_admin'))
             else:
                 # Log failed attempt
-                failed_attempts = session.get('failed_login_attempts', {})
-                key = f"{role}:{identifier}" # Use a string key instead of a tuple
-                failed_attempts[key] = failed_attempts.get(key, 0) + 1
-                session['failed_login_attempts'] = failed_attempts
+                failed_attempts = failed_logins.record(role, identifier)
 
-                if failed_attempts[key] >= 3: # Log warning after 3 failed attempts
-                    current_app.logger.warning(f"Brute-force attempt detected for admin {identifier} from {request.remote_addr}. Failed attempts: {failed_attempts[key]}")
+                if failed_attempts >= 3: # Log warning after 3 failed attempts
+                    current_app.logger.warning(f"Brute-force attempt detected for admin {identifier} from {request.remote_addr}. Failed attempts: {failed_attempts}")
                 else:
                     current_app.logger.warning(f"Login failed for admin {identifier} from {request.remote_addr}")
                 flash('Login gagal. Periksa username dan password Anda.', 'danger')
@@ -68,20 +74,19 @@ def login():
             
             if not (user and user.check_password(form.password.data)):
                 # Log failed attempt
-                failed_attempts = session.get('failed_login_attempts', {})
-                key = f"{role}:{identifier}" # Use a string key instead of a tuple
-                failed_attempts[key] = failed_attempts.get(key, 0) + 1
-                session['failed_login_attempts'] = failed_attempts
+                failed_attempts = failed_logins.record(role, identifier)
 
-                if failed_attempts[key] >= 3: # Log warning after 3 failed attempts
-                    current_app.logger.warning(f"Brute-force attempt detected for NIA {identifier} from {request.remote_addr}. Failed attempts: {failed_attempts[key]}")
+                if failed_attempts >= 3: # Log warning after 3 failed attempts
+                    current_app.logger.warning(f"Brute-force attempt detected for NIA {identifier} from {request.remote_addr}. Failed attempts: {failed_attempts}")
                 else:
                     current_app.logger.warning(f"Login failed for NIA {identifier}: Invalid credentials from {request.remote_addr}")
                 flash('Kredensial tidak valid.', 'danger')
                 return render_template('login.html', title='Login', form=form)
 
             # Reset failed login attempts on successful login
-            session.pop('failed_login_attempts', None)
+            failed_logins.clear(role, identifier)
+            # Store a rehashed password, if check_password upgraded it
+            db.session.commit()
 
             if not user.is_active:
                 current_app.logger.warning(f"Login failed for NIA {identifier}: Account not active from {request.remote_addr}")
@@ -89,6 +94,7 @@ def login():
                 return render_template('login.html', title='Login', form=form)
 
             # Store user ID in session for 2FA verification
+            rotate_session()
             session['two_factor_user_id'] = user.id
             return redirect(url_for('auth.verify_token'))
 
@@ -134,6 +140,7 @@ def verify_token():
         if user.check_access_token(form.access_token.data):
             user.access_token_used = True # Mark token as used
             db.session.commit()
+            rotate_session()
             login_user(user)
             del session['two_factor_user_id'] # Clear temporary session data
             current_app.logger.info(f"Anggota user {user.username} (NIA: {user.nia}) logged in successfully via 2FA from {request.remote_addr}")
@@ -153,6 +160,17 @@ def logout():
     flash('Anda telah berhasil logout.', 'info')
     return redirect(url_for('auth.home'))
 
+def _roster_total():
+    return directory_cache.total(lambda: roster_query().with_entities(db.func.count(User.id)).scalar())
+
+def _roster_page(cursor):
+    """One keyset page of the member roster, from the directory cache."""
+    per_page = current_app.config.get('ROSTER_PER_PAGE', 50)
+    total = _roster_total()
+    return directory_cache.page(cursor, per_page, lambda: keyset_paginate(
+        roster_query(), User.nama_lengkap, User.id, sort_order='asc', cursor=cursor, per_page=per_page, total=total
+    ))
+
 @auth_bp.route('/dashboard/admin')
 @login_required
 @requires_role('admin')
@@ -160,7 +178,7 @@ def dashboard_admin():
     current_app.logger.info(f"Admin user {current_user.username} accessed admin dashboard from {request.remote_addr}")
     
     # The list of members is now managed on a separate page
-    total_anggota = User.query.filter_by(role='anggota').count()
+    total_anggota = _roster_total()
     
     return render_template('dashboard_admin.html', title='Dashboard Admin', user=current_user, total_anggota=total_anggota)
 
@@ -169,7 +187,7 @@ def dashboard_admin():
 @requires_role('admin')
 def manage_members():
     current_app.logger.info(f"Admin user {current_user.username} accessed member management page from {request.remote_addr}")
-    anggota_list = User.query.filter_by(role='anggota').order_by(User.nama_lengkap).all()
+    anggota_list = _roster_page(request.args.get('cursor', '', type=str))
     return render_template('admin/manage_members.html', title='Manajemen Anggota', anggota_list=anggota_list)
 
 @auth_bp.route('/dashboard/anggota')
@@ -177,8 +195,8 @@ def manage_members():
 @requires_role('anggota')
 def dashboard_anggota():
     current_app.logger.info(f"Anggota user {current_user.username} accessed anggota dashboard from {request.remote_addr}")
-    anggota_list = User.query.filter_by(role='anggota').order_by(User.nama_lengkap).all()
-    return render_template('dashboard_anggota.html', title='Dashboard Anggota', user=current_user, anggota_list=anggota_list)
+    # The roster itself is on list_anggota; the dashboard only shows its size
+    return render_template('dashboard_anggota.html', title='Dashboard Anggota', user=current_user, total_anggota=_roster_total())
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
@@ -208,7 +226,7 @@ def register():
 @auth_bp.route('/anggota/daftar')
 @login_required
 def list_anggota():
-    anggota_list = User.query.filter_by(role='anggota').order_by(User.nama_lengkap).all()
+    anggota_list = _roster_page(request.args.get('cursor', '', type=str))
     return render_template('anggota/list.html', title='Daftar Anggota', anggota_list=anggota_list)
 
 @auth_bp.route('/admin/pendaftaran')
@@ -239,6 +257,44 @@ def approve_user(user_id):
     
     return redirect(url_for('auth.manage_members'))
 
+@auth_bp.route('/admin/approve-bulk', methods=['POST'])
+@login_required
+@requires_role('admin')
+def approve_users_bulk():
+    user_ids = request.form.getlist('user_ids', type=int)
+    if not user_ids:
+        flash('Pilih minimal satu pendaftar untuk disetujui.', 'warning')
+        return redirect(url_for('auth.pending_registrations'))
+
+    users = (
+        User.query
+        .filter(User.id.in_(user_ids), User.role == 'anggota', User.is_active.is_(False))
+        .order_by(User.nama_lengkap)
+        .with_for_update() # another admin approving the same users waits, then finds them active
+        .all()
+    )
+    if not users:
+        flash('Pendaftar yang dipilih sudah aktif atau tidak ditemukan.', 'info')
+        return redirect(url_for('auth.pending_registrations'))
+
+    # Codes handed out on a sheet need longer than the 5 minutes of a single approval
+    expires_in = current_app.config.get('BULK_ACCESS_TOKEN_EXPIRES', 24 * 3600)
+    rows = []
+    for user in users:
+        access_token = secrets.token_hex(6)
+        user.is_active = True
+        user.set_access_token(access_token, expires_in_seconds=expires_in)
+        rows.append((user.nama_lengkap, user.username, user.nia, access_token, user.access_token_expiration.strftime('%Y-%m-%d %H:%M UTC')))
+    db.session.commit()
+
+    current_app.logger.info(f"Admin {current_user.username} approved {len(users)} users in bulk: {', '.join(user.username for user in users)}.")
+    header = ['Nama Lengkap', 'Username', 'NIA', 'Kode Akses', 'Berlaku Sampai']
+    response = Response(b''.join(iter_csv(header, rows)), mimetype='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename="kode_akses_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
+    # One-time codes: keep the sheet out of any cache
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @auth_bp.route('/admin/reissue-token/<int:user_id>', methods=['POST'])
 @login_required
 @requires_role('admin')
@@ -256,3 +312,36 @@ def reissue_token(user_id):
     flash(f'Kode akses baru untuk "{user.nama_lengkap}" adalah: {access_token}', 'success')
     
     return redirect(url_for('auth.manage_members'))
+
+@auth_bp.route('/admin/cache-stats')
+@login_required
+@requires_role('admin')
+def cache_stats():
+    return jsonify({'users': user_cache.stats(), 'counts': count_cache.stats(), 'directory': directory_cache.stats()})
+
+@auth_bp.route('/admin/jobs')
+@login_required
+@requires_role('admin')
+def job_status():
+    status = request.args.get('status', '', type=str)
+    query = Job.query
+    if status in STATUSES:
+        query = query.filter_by(status=status)
+    else:
+        status = ''
+    jobs = query.order_by(Job.id.desc()).limit(100).all()
+    return render_template('admin/jobs.html', title='Antrian Tugas', jobs=jobs, counts=status_counts(), status=status)
+
+@auth_bp.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@requires_role('admin')
+def retry_failed_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'failed':
+        flash(f'Tugas #{job.id} tidak dalam status gagal.', 'info')
+        return redirect(url_for('auth.job_status'))
+    retry_job(job)
+    db.session.commit()
+    current_app.logger.info(f"Admin {current_user.username} requeued job {job.id} ({job.kind}).")
+    flash(f'Tugas #{job.id} dimasukkan kembali ke antrian.', 'success')
+    return redirect(url_for('auth.job_status', status='failed'))
@@ -1,14 +1,21 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_from_directory, abort, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app
 from flask_login import login_required, current_user
 from app import db
 from app.models import SuratKeluar, User
-from app.forms import SuratKeluarForm
+from app.forms import SuratKeluarForm, ImportSuratForm
 from app.decorators import requires_role, owns_resource # Updated import
+from app.queries import ListFilter, SURAT_KELUAR_LIST, list_query
+from app.pagination import keyset_paginate
+from app.cache import count_cache
+from app.export import export_response
+from app.importer import import_letters, manifest_columns
+from app.storage import UploadRejected, save_upload, release_reference, remove_legacy_file
+from app.downloads import send_letter_archive, send_letter_file, send_letter_preview
+from app.previews import PREVIEW, THUMBNAIL
+import io
 import os
-import uuid
 from werkzeug.utils import secure_filename
 from datetime import datetime
-import filetype
 
 surat_keluar_bp = Blueprint('surat_keluar', __name__, url_prefix='/surat_keluar')
 
@@ -16,95 +23,95 @@ UPLOAD_FOLDER = os.path.join(os.getcwd(), 'app', 'uploads', 'surat_keluar')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-ALLOWED_MIME_TYPES = {
-    'application/pdf',
-    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-    'image/jpeg'
-}
-
-def is_allowed_file(file_stream):
-    try:
-        # Read the first 2048 bytes to determine the mime type
-        mime_type = magic.from_buffer(file_stream.read(2048), mime=True)
-        file_stream.seek(0)  # Reset stream position
-        return mime_type in ALLOWED_MIME_TYPES
-    except Exception:
-        return False
-
 @surat_keluar_bp.route('/')
 @login_required
 def list_surat_keluar():
-    # Whitelist for query parameters
-    allowed_search_by = ['nomor_surat', 'tujuan_surat', 'perihal']
-    allowed_sort_by = ['nomor_surat', 'tujuan_surat', 'tanggal_surat', 'perihal']
-    allowed_sort_order = ['asc', 'desc']
-
-    # Get and validate parameters
-    page = request.args.get('page', 1, type=int)
-    search_query = request.args.get('search', '', type=str)
-    search_by = request.args.get('search_by', 'nomor_surat', type=str)
-    start_date_str = request.args.get('start_date', '', type=str)
-    end_date_str = request.args.get('end_date', '', type=str)
-    sort_by = request.args.get('sort_by', 'tanggal_surat', type=str)
-    sort_order = request.args.get('sort_order', 'desc', type=str)
-
-    # Validate against whitelists
-    if search_by not in allowed_search_by:
-        search_by = 'nomor_surat'
-    if sort_by not in allowed_sort_by:
-        sort_by = 'tanggal_surat'
-    if sort_order not in allowed_sort_order:
-        sort_order = 'desc'
-
-    query = SuratKeluar.query
-
-    # Filter based on user role
-    if current_user.role == 'anggota':
-        query = query.filter_by(uploaded_by_user_id=current_user.id)
-
-    # Apply search filters
-    if search_query:
-        if search_by == 'nomor_surat':
-            query = query.filter(SuratKeluar.nomor_surat.ilike(f'%{search_query}%'))
-        elif search_by == 'tujuan_surat':
-            query = query.filter(SuratKeluar.tujuan_surat.ilike(f'%{search_query}%'))
-        elif search_by == 'perihal':
-            query = query.filter(SuratKeluar.perihal.ilike(f'%{search_query}%'))
-
-    # Apply date filters
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            query = query.filter(SuratKeluar.tanggal_surat >= start_date)
-        except ValueError:
-            flash('Format tanggal mulai tidak valid.', 'warning')
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            query = query.filter(SuratKeluar.tanggal_surat <= end_date)
-        except ValueError:
-            flash('Format tanggal akhir tidak valid.', 'warning')
-
-    # Apply sorting
-    sort_column = getattr(SuratKeluar, sort_by, SuratKeluar.tanggal_surat)
-    if sort_order == 'asc':
-        query = query.order_by(sort_column.asc())
-    else:
-        query = query.order_by(sort_column.desc())
-
-    surat_keluar_list = query.paginate(page=page, per_page=10, error_out=False)
+    # Search/sort parameters are validated against the whitelists in SURAT_KELUAR_LIST
+    filters = ListFilter.from_request(SURAT_KELUAR_LIST)
+    page = request.args.get('page', type=int)
+    cursor = request.args.get('cursor', '', type=str)
+
+    query = filters.apply(list_query(SURAT_KELUAR_LIST))
+    # Totals per filter signature are cached and kept current by add/edit/delete
+    total = count_cache.count(filters, query)
+
+    # Keyset pagination: seek on (sort column, id) instead of OFFSET
+    surat_keluar_list = keyset_paginate(
+        query,
+        filters.sort_column,
+        SuratKeluar.id,
+        sort_order=filters.sort_order,
+        cursor=cursor,
+        page=page,
+        per_page=10,
+        key=filters.sort_key,
+        total=total,
+        seek=filters.seek
+    )
 
     return render_template(
         'surat_keluar/list.html',
         title='Surat Keluar',
         surat_keluar_list=surat_keluar_list,
-        search_query=search_query,
-        search_by=search_by,
-        start_date=start_date_str,
-        end_date=end_date_str,
-        sort_by=sort_by,
-        sort_order=sort_order
+        search_query=filters.search_query,
+        search_by=filters.search_by,
+        start_date=filters.start_date_str,
+        end_date=filters.end_date_str,
+        sort_by=filters.sort_by,
+        sort_order=filters.sort_order
     )
+@surat_keluar_bp.route('/export')
+@login_required
+@requires_role('admin')
+def export_surat_keluar():
+    # Same whitelisted search/sort/date parameters as the list view
+    filters = ListFilter.from_request(SURAT_KELUAR_LIST)
+    export_format = request.args.get('format', 'csv', type=str)
+    if export_format not in ('csv', 'xlsx'):
+        export_format = 'csv'
+    current_app.logger.info(f"Admin user {current_user.username} exported Surat Keluar ({export_format}) from {request.remote_addr}")
+    return export_response(filters, export_format)
+
+@surat_keluar_bp.route('/download-zip')
+@login_required
+@requires_role('admin')
+def download_zip_surat_keluar():
+    # Every file matching the list filters, zipped while it streams
+    filters = ListFilter.from_request(SURAT_KELUAR_LIST)
+    current_app.logger.info(f"Admin user {current_user.username} downloaded a ZIP of Surat Keluar (search={filters.search_query!r}, {filters.start_date_str}..{filters.end_date_str}) from {request.remote_addr}")
+    return send_letter_archive(filters, UPLOAD_FOLDER)
+
+@surat_keluar_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+@requires_role('admin')
+def import_surat_keluar():
+    # Archives larger than MAX_CONTENT_LENGTH go through `flask import-surat` instead
+    form = ImportSuratForm()
+    report = None
+    if form.validate_on_submit():
+        manifest = io.TextIOWrapper(form.manifest.data.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_letters(
+                SURAT_KELUAR_LIST,
+                manifest,
+                form.arsip.data.stream,
+                current_user.id,
+                workers=current_app.config.get('IMPORT_WORKERS', 4),
+                batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 500)
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'Impor gagal: {e}', 'danger')
+        else:
+            current_app.logger.info(f"Admin user {current_user.username} imported {report.inserted} Surat Keluar ({len(report.errors)} rows rejected) from {request.remote_addr}")
+            flash(f'{report.inserted} Surat Keluar berhasil diimpor, {len(report.errors)} baris ditolak.', 'success' if not report.errors else 'warning')
+    return render_template(
+        'surat_keluar/import.html',
+        title='Impor Surat Keluar',
+        form=form,
+        report=report,
+        columns=manifest_columns(SURAT_KELUAR_LIST)
+    )
+
 @surat_keluar_bp.route('/add', methods=['GET', 'POST'])
 @login_required
 @requires_role('admin') # Changed from roles_required
@@ -114,21 +121,21 @@ def add_surat_keluar():
         if form.file_surat.data:
             file = form.file_surat.data
             
-            if not is_allowed_file(file.stream):
-                flash('Jenis file tidak diizinkan. Hanya PDF, DOCX, dan JPG yang diperbolehkan.', 'danger')
+            # One pass over the upload: type sniff, 5 MB limit, hash and write.
+            # Identical files are stored once and shared (see app.storage)
+            try:
+                blob = save_upload(file.stream)
+            except UploadRejected as e:
+                flash(str(e), 'danger')
                 return render_template('surat_keluar/form.html', title='Tambah Surat Keluar', form=form)
 
-            filename = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + '_' + filename
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-            file.save(file_path)
-
             surat_keluar = SuratKeluar(
                 nomor_surat=form.nomor_surat.data,
                 tujuan_surat=form.tujuan_surat.data,
                 tanggal_surat=form.tanggal_surat.data,
                 perihal=form.perihal.data,
-                file_path=unique_filename,
+                file_path=secure_filename(file.filename) or blob.digest,
+                file_digest=blob.digest,
                 uploaded_by_user_id=current_user.id
             )
             db.session.add(surat_keluar)
@@ -152,19 +159,20 @@ def edit_surat_keluar(surat_id):
         if form.file_surat.data:
             file = form.file_surat.data
 
-            if not is_allowed_file(file.stream):
-                flash('Jenis file tidak diizinkan. Hanya PDF, DOCX, dan JPG yang diperbolehkan.', 'danger')
+            # Store the new file before releasing the old one, so re-uploading
+            # the same content keeps its blob alive
+            try:
+                blob = save_upload(file.stream)
+            except UploadRejected as e:
+                flash(str(e), 'danger')
                 return render_template('surat_keluar/form.html', title='Edit Surat Keluar', form=form, surat_keluar=surat_keluar)
-
-            # Delete old file
-            if old_file_path and os.path.exists(os.path.join(UPLOAD_FOLDER, old_file_path)):
-                os.remove(os.path.join(UPLOAD_FOLDER, old_file_path))
-
-            filename = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + '_' + filename
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-            file.save(file_path)
-            surat_keluar.file_path = unique_filename
+            # Old files are removed by the job worker once this commits
+            if surat_keluar.file_digest:
+                release_reference(surat_keluar.file_digest)
+            else:
+                remove_legacy_file(UPLOAD_FOLDER, old_file_path)
+            surat_keluar.file_digest = blob.digest
+            surat_keluar.file_path = secure_filename(file.filename) or blob.digest
 
         surat_keluar.nomor_surat = form.nomor_surat.data
         surat_keluar.tujuan_surat = form.tujuan_surat.data
@@ -183,8 +191,11 @@ def edit_surat_keluar(surat_id):
 @owns_resource(SuratKeluar, 'surat_id') # Added owns_resource
 def delete_surat_keluar(surat_id):
     surat_keluar = SuratKeluar.query.get_or_404(surat_id)
-    if surat_keluar.file_path and os.path.exists(os.path.join(UPLOAD_FOLDER, surat_keluar.file_path)):
-        os.remove(os.path.join(UPLOAD_FOLDER, surat_keluar.file_path))
+    # File removal is queued with the delete and done by the job worker
+    if surat_keluar.file_digest:
+        release_reference(surat_keluar.file_digest)
+    else:
+        remove_legacy_file(UPLOAD_FOLDER, surat_keluar.file_path)
     db.session.delete(surat_keluar)
     db.session.commit()
     current_app.logger.info(f"Admin user {current_user.username} deleted Surat Keluar: {surat_keluar.nomor_surat} (ID: {surat_id}) from {request.remote_addr}")
@@ -199,8 +210,18 @@ def download_surat_keluar(surat_id):
     surat_keluar = SuratKeluar.query.get_or_404(surat_id)
     try:
         current_app.logger.info(f"User {current_user.username} downloaded Surat Keluar: {surat_keluar.nomor_surat} (ID: {surat_id}) from {request.remote_addr}")
-        return send_from_directory(UPLOAD_FOLDER, surat_keluar.file_path, as_attachment=True)
+        # Auth and ownership are checked above; DOWNLOAD_OFFLOAD decides who sends the bytes
+        return send_letter_file(surat_keluar, UPLOAD_FOLDER)
     except FileNotFoundError:
         current_app.logger.error(f"File not found for Surat Keluar ID: {surat_id} (Path: {surat_keluar.file_path}) requested by {current_user.username} from {request.remote_addr}")
         flash('File tidak ditemukan.', 'danger')
         abort(404)
+
+@surat_keluar_bp.route('/preview/<int:surat_id>')
+@login_required
+@requires_role('admin')
+@owns_resource(SuratKeluar, 'surat_id')
+def preview_surat_keluar(surat_id):
+    surat_keluar = SuratKeluar.query.get_or_404(surat_id)
+    variant = THUMBNAIL if request.args.get('size') == 'thumb' else PREVIEW
+    return send_letter_preview(surat_keluar, variant)
@@ -0,0 +1,380 @@
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import Float, case, column, false, func, literal_column, or_, select, table, text, type_coerce
+from sqlalchemy.dialects.mysql import match
+from app import db
+from app.models import BlobText
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# InnoDB ignores words shorter than innodb_ft_min_token_size (3 by default)
+MYSQL_MIN_TOKEN_SIZE = 3
+
+# Prefix of the MySQL FULLTEXT indexes the migrations create
+FULLTEXT_INDEX_PREFIX = 'ft_'
+
+# Most ids the pure-Python index hands back to the database; broader
+# searches fall back to LikeSearch rather than drop matches
+PYTHON_INDEX_MAX_RESULTS = 5000
+
+# Every backend also offers apply_content(query, spec, term), matching letters
+# on the text extracted from their files (BlobText.search_text, see
+# app.extraction) instead of on their own columns.
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(value.lower()) if value else []
+
+
+def is_search_object(name, type_):
+    """True for full-text objects the models do not declare: FULLTEXT indexes
+    (made by migrations) and FTS5 tables with their shadow tables (made on
+    first use). Autogenerate leaves them alone, see migrations/env.py."""
+    if type_ == 'index':
+        return name.startswith(FULLTEXT_INDEX_PREFIX)
+    if type_ == 'table':
+        return name.endswith('_fts') or '_fts_' in name
+    return False
+
+
+class LikeSearch:
+    """Legacy substring search. Needs no index, but always scans the table."""
+
+    name = 'like'
+
+    def apply(self, query, spec, fields, term):
+        model = spec.model
+        query = query.filter(or_(*[getattr(model, field).ilike(f'%{term}%') for field in fields]))
+        return query, None
+
+    def apply_content(self, query, spec, term):
+        digests = select(BlobText.digest).where(BlobText.search_text.ilike(f'%{term}%'))
+        return query.filter(spec.model.file_digest.in_(digests)), None
+
+    def reindex(self, spec):
+        pass
+
+    def reindex_content(self):
+        pass
+
+
+class MySQLFullTextSearch:
+    """MATCH ... AGAINST over the FULLTEXT indexes created by the migrations.
+
+    Every search_by choice has its own FULLTEXT index because MySQL only uses
+    an index whose column list matches the MATCH() list exactly.
+    """
+
+    name = 'mysql'
+
+    def apply(self, query, spec, fields, term):
+        against, short_tokens = self._against(term)
+        if not against:
+            return LikeSearch().apply(query, spec, fields, term)
+        columns = [getattr(spec.model, field) for field in fields]
+        score = type_coerce(match(*columns, against=against).in_boolean_mode(), Float)
+        query = query.filter(score > 0)
+        for token in short_tokens:
+            query = query.filter(or_(*[column.ilike(f'%{token}%') for column in columns]))
+        return query, score
+
+    @staticmethod
+    def _against(term):
+        """(AGAINST string, words too short for the index). The short words
+        are still required, as LIKE conditions next to the MATCH."""
+        tokens = tokenize(term)
+        # Every word must match, and each word also matches as a prefix
+        against = ' '.join(f'+{token}*' for token in tokens if len(token) >= MYSQL_MIN_TOKEN_SIZE)
+        return against, [token for token in tokens if len(token) < MYSQL_MIN_TOKEN_SIZE]
+
+    def apply_content(self, query, spec, term):
+        against, short_tokens = self._against(term)
+        if not against:
+            return LikeSearch().apply_content(query, spec, term)
+        score = type_coerce(match(BlobText.search_text, against=against).in_boolean_mode(), Float)
+        query = query.join(BlobText, BlobText.digest == spec.model.file_digest).filter(score > 0)
+        for token in short_tokens:
+            query = query.filter(BlobText.search_text.ilike(f'%{token}%'))
+        return query, score
+
+    def reindex(self, spec):
+        # InnoDB maintains FULLTEXT indexes itself
+        pass
+
+    def reindex_content(self):
+        pass
+
+
+class SQLiteFTSSearch:
+    """SQLite FTS5 external-content tables, kept in sync by triggers."""
+
+    name = 'sqlite'
+
+    def __init__(self):
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fts_name(spec):
+        return f'{spec.model.__tablename__}_fts'
+
+    def ensure_index(self, spec):
+        self._ensure(self.fts_name(spec), spec.model.__tablename__, spec.text_fields)
+
+    def _ensure(self, name, base, fields):
+        if name in self._ready:
+            return
+        with self._lock:
+            if name in self._ready:
+                return
+            cols = ', '.join(fields)
+            new_cols = ', '.join(f'new.{field}' for field in fields)
+            old_cols = ', '.join(f'old.{field}' for field in fields)
+            with db.engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': name}
+                ).first()
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({cols}, content='{base}', content_rowid='id')"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {base} BEGIN "
+                    f"INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {base} BEGIN "
+                    f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE ON {base} BEGIN "
+                    f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+                    f"INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                ))
+                if not exists:
+                    # Rows written before the index existed
+                    conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+            self._ready.add(name)
+
+    def apply(self, query, spec, fields, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return LikeSearch().apply(query, spec, fields, term)
+        self.ensure_index(spec)
+        name = self.fts_name(spec)
+        fts = table(name, column('rowid'))
+        expression = '{%s} : (%s)' % (' '.join(fields), ' '.join(f'"{token}"*' for token in tokens))
+        query = query.join(fts, fts.c.rowid == spec.model.id).filter(literal_column(name).op('MATCH')(expression))
+        # bm25() is lower-is-better, so negate it to rank in descending order
+        score = type_coerce(-func.bm25(literal_column(name)), Float)
+        return query, score
+
+    def apply_content(self, query, spec, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return LikeSearch().apply_content(query, spec, term)
+        name = f'{BlobText.__tablename__}_fts'
+        self._ensure(name, BlobText.__tablename__, ['search_text'])
+        fts = table(name, column('rowid'))
+        expression = ' '.join(f'"{token}"*' for token in tokens)
+        query = (query.join(BlobText, BlobText.digest == spec.model.file_digest)
+                 .join(fts, fts.c.rowid == BlobText.id)
+                 .filter(literal_column(name).op('MATCH')(expression)))
+        score = type_coerce(-func.bm25(literal_column(name)), Float)
+        return query, score
+
+    def _rebuild(self, name):
+        with db.engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+
+    def reindex(self, spec):
+        self.ensure_index(spec)
+        self._rebuild(self.fts_name(spec))
+
+    def reindex_content(self):
+        name = f'{BlobText.__tablename__}_fts'
+        self._ensure(name, BlobText.__tablename__, ['search_text'])
+        self._rebuild(name)
+
+
+class InvertedIndex:
+    """In-memory inverted index over the text fields of one letter table."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = {} # token -> {doc_id: {field: term frequency}}
+        self.documents = {} # doc_id -> tokens, so a document can be removed again
+        self.vocabulary = [] # sorted tokens, for prefix lookups
+        self.signature = None
+
+    def add(self, doc_id, values):
+        self.remove(doc_id)
+        tokens = set()
+        for field in self.fields:
+            for token in tokenize(values.get(field)):
+                if token not in self.postings:
+                    self.postings[token] = {}
+                    insort(self.vocabulary, token)
+                fields = self.postings[token].setdefault(doc_id, {})
+                fields[field] = fields.get(field, 0) + 1
+                tokens.add(token)
+        self.documents[doc_id] = tokens
+
+    def remove(self, doc_id):
+        for token in self.documents.pop(doc_id, ()):
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+
+    def _expand(self, prefix):
+        position = bisect_left(self.vocabulary, prefix)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+            yield self.vocabulary[position]
+            position += 1
+
+    def search(self, fields, tokens):
+        """Return {doc_id: score} for documents matching every token (as a prefix)."""
+        total_docs = max(len(self.documents), 1)
+        scores = None
+        for prefix in tokens:
+            matched = {}
+            for token in self._expand(prefix):
+                postings = self.postings[token]
+                if not postings:
+                    continue
+                idf = math.log(1 + total_docs / len(postings))
+                for doc_id, frequencies in postings.items():
+                    tf = sum(frequencies.get(field, 0) for field in fields)
+                    if tf:
+                        matched[doc_id] = max(matched.get(doc_id, 0.0), (1 + math.log(tf)) * idf)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {doc_id: score + matched[doc_id] for doc_id, score in scores.items() if doc_id in matched}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+class PythonIndexSearch:
+    """Pure-Python fallback for databases without a usable full-text index.
+
+    Each worker builds its index on first use. Every search reads a cheap
+    (count, max id, max changed-at) signature from the database, so writes
+    by any worker or host are noticed: rows changed since the last look are
+    re-read, and a count that still disagrees (deletes) means a rebuild.
+    """
+
+    name = 'python'
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def _index(self, model, fields, doc_column, changed_column):
+        signature = tuple(db.session.query(func.count(model.id), func.max(model.id), func.max(changed_column)).one())
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is not None and index.signature == signature:
+                return index
+            query = db.session.query(doc_column, *[getattr(model, field) for field in fields])
+            if index is not None and index.signature[2] is not None:
+                # Rows stamped in the same instant as the last look are read again
+                for row in query.filter(changed_column >= index.signature[2]).yield_per(500):
+                    index.add(row[0], dict(zip(fields, row[1:])))
+                if len(index.documents) == signature[0]:
+                    index.signature = signature
+                    return index
+            # First use, or rows were deleted since the last look
+            index = InvertedIndex(fields)
+            for row in query.yield_per(500):
+                index.add(row[0], dict(zip(fields, row[1:])))
+            index.signature = signature
+            self._indexes[model] = index
+            return index
+
+    def _ranked(self, index, fields, tokens):
+        """Scores of the matching documents, or None when there are more than
+        PYTHON_INDEX_MAX_RESULTS of them."""
+        with self._lock:
+            scores = index.search(fields, tokens)
+        if len(scores) > PYTHON_INDEX_MAX_RESULTS:
+            return None
+        return {doc_id: round(score, 6) for doc_id, score in scores.items()}
+
+    def apply(self, query, spec, fields, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return LikeSearch().apply(query, spec, fields, term)
+        model = spec.model
+        scores = self._ranked(self._index(model, spec.text_fields, model.id, model.updated_at), fields, tokens)
+        if scores is None:
+            # Too broad to hand over as ids; LIKE finds them all, unranked
+            return LikeSearch().apply(query, spec, fields, term)
+        if not scores:
+            return query.filter(false()), None
+        score = type_coerce(case(scores, value=model.id, else_=0.0), Float)
+        return query.filter(model.id.in_(list(scores))), score
+
+    def apply_content(self, query, spec, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return LikeSearch().apply_content(query, spec, term)
+        # Documents are keyed by blob digest; letters find theirs through file_digest
+        index = self._index(BlobText, ['search_text'], BlobText.digest, BlobText.extracted_at)
+        scores = self._ranked(index, ['search_text'], tokens)
+        if scores is None:
+            return LikeSearch().apply_content(query, spec, term)
+        if not scores:
+            return query.filter(false()), None
+        model = spec.model
+        score = type_coerce(case(scores, value=model.file_digest, else_=0.0), Float)
+        return query.filter(model.file_digest.in_(list(scores))), score
+
+    def reindex(self, spec):
+        with self._lock:
+            self._indexes.pop(spec.model, None)
+
+    def reindex_content(self):
+        with self._lock:
+            self._indexes.pop(BlobText, None)
+
+
+def _sqlite_has_fts5():
+    with db.engine.connect() as conn:
+        options = {row[0] for row in conn.execute(text('PRAGMA compile_options'))}
+    return 'ENABLE_FTS5' in options
+
+
+def get_search_backend():
+    """Return the search backend for the current app (chosen once per app).
+
+    SEARCH_BACKEND may force 'mysql', 'sqlite', 'python' or 'like'; the
+    default 'auto' picks the native full-text engine of the database.
+    """
+    backend = current_app.extensions.get('search_backend')
+    if backend is not None:
+        return backend
+    choice = current_app.config.get('SEARCH_BACKEND', 'auto')
+    if choice == 'auto':
+        dialect = db.engine.dialect.name
+        if dialect == 'mysql':
+            choice = 'mysql'
+        elif dialect == 'sqlite' and _sqlite_has_fts5():
+            choice = 'sqlite'
+        else:
+            choice = 'python'
+    backends = {
+        'like': LikeSearch,
+        'mysql': MySQLFullTextSearch,
+        'sqlite': SQLiteFTSSearch,
+        'python': PythonIndexSearch,
+    }
+    if choice not in backends:
+        raise ValueError(f'Unknown SEARCH_BACKEND: {choice}')
+    backend = backends[choice]()
+    current_app.extensions['search_backend'] = backend
+    current_app.logger.info(f'Search backend: {backend.name}')
+    return backend
@@ -0,0 +1,145 @@
+import secrets
+import time
+from flask import session as current_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from app.utils import LocalSQLite
+
+# Expired sessions are deleted at most this often (seconds) per process
+SWEEP_INTERVAL = 300
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sessions (
+        sid TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)',
+]
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session data kept on the server; the cookie only carries ``sid``.
+    Inherits the modified/accessed tracking of Flask's cookie session."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, so an id planted before login is
+        worthless after it (session fixation)."""
+        if self.sid and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Stores sessions in a local SQLite file (see app.utils.LocalSQLite),
+    shared by every worker on the host.
+
+    A row is written only when the session changed, or when less than half
+    of its lifetime is left; other requests just read it. Sessions live for
+    PERMANENT_SESSION_LIFETIME after their last write whether or not they
+    are permanent, and expired rows are swept now and then.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, uri):
+        self.db = LocalSQLite(uri, _SCHEMA)
+        self._last_sweep = 0.0
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self.db.connection().execute(
+                'SELECT data, expires_at FROM sessions WHERE sid = ?', (sid,)
+            ).fetchone()
+            if row and row[1] > time.time():
+                return ServerSideSession(self.serializer.loads(row[0]), sid=sid, expires_at=row[1])
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        lifetime = self._lifetime(app)
+
+        if not session:
+            if session.sid or session.previous_sid:
+                self._delete(session.sid, session.previous_sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        stale = session.expires_at is not None and session.expires_at - now < lifetime / 2
+        if not (session.modified or stale or session.sid is None):
+            return
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + lifetime
+        with self.db.write() as connection:
+            if session.previous_sid:
+                connection.execute('DELETE FROM sessions WHERE sid = ?', (session.previous_sid,))
+            connection.execute(
+                'INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at',
+                (session.sid, self.serializer.dumps(dict(session)), session.expires_at),
+            )
+            self._sweep(connection, now)
+        # The cookie holds nothing but the id, so it is only sent when the id changes
+        # or the expiry of a permanent session moves
+        if new_sid or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _delete(self, *sids):
+        sids = [sid for sid in sids if sid]
+        with self.db.write() as connection:
+            connection.executemany('DELETE FROM sessions WHERE sid = ?', [(sid,) for sid in sids])
+
+    def _sweep(self, connection, now):
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        connection.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+
+
+def init_sessions(app):
+    uri = app.config.get('SESSION_STORE') or 'cookie'
+    if uri == 'cookie':
+        return
+    if not uri.startswith('sqlite:////'):
+        app.logger.warning(f'SESSION_STORE {uri} is a relative path; sessions are lost when the '
+                           f'working directory is replaced (e.g. on redeploy)')
+    app.session_interface = SQLiteSessionInterface(uri)
+
+
+def rotate_session():
+    """Give the current session a new id on login. A no-op for cookie
+    sessions, whose content is re-signed anyway."""
+    if isinstance(current_session._get_current_object(), ServerSideSession):
+        current_session.regenerate()
@@ -0,0 +1,383 @@
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import filetype
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
+from werkzeug.utils import safe_join
+from app import db
+from app.imaging import ORIGINAL, Image, recompress_jpeg
+from app.jobs import enqueue, job_handler
+from app.models import Blob
+from app.utils import ProcessPool, Throttle
+
+ALLOWED_MIME_TYPES = {
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'image/jpeg'
+}
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# Uploads are read in chunks of this size; the first SNIFF_SIZE bytes decide the MIME type
+_CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 2048
+
+# Legacy uploads were saved as str(uuid4()) + '_' + filename
+LEGACY_NAME_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_')
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+JPEG_MIME = 'image/jpeg'
+
+_jpeg_pool = ProcessPool()
+
+
+class UploadRejected(ValueError):
+    """The upload broke a type or size rule; the message is shown to the user."""
+
+
+def too_large_message(max_size):
+    return f'Ukuran file terlalu besar (maksimal {max_size // (1024 * 1024)}MB).'
+
+
+def read_head(stream, size=SNIFF_SIZE):
+    """Read up to ``size`` bytes, tolerating short reads."""
+    head = b''
+    while len(head) < size:
+        chunk = stream.read(size - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def sniff_mime(head):
+    kind = filetype.guess(head)
+    return kind.mime if kind else None
+
+
+class BlobStore:
+    """Content-addressed file store: every distinct file is kept once, named
+    by the SHA-256 of its content.
+
+    Files live two directory levels deep, ``ab/cd/abcd...``, so no directory
+    holds more than a few thousand entries. Blobs written before sharding sit
+    directly in the root until `flask storage-reshard` moves them; lookups
+    fall back to that flat location meanwhile.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def relative_path(digest):
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def _flat_path(self, digest):
+        return os.path.join(self.root, digest)
+
+    def locate(self, digest):
+        """Path of the stored file relative to root, sharded or flat; the
+        sharded path when neither exists."""
+        if not os.path.exists(self.path(digest)) and os.path.exists(self._flat_path(digest)):
+            return digest
+        return self.relative_path(digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest)) or os.path.exists(self._flat_path(digest))
+
+    def spool(self, stream, head=b'', max_size=None):
+        """Copy ``stream`` (after ``head``, bytes already read from it) to a temp
+        file in one pass, hashing and size-checking every chunk. Returns
+        (temp path, digest, size); raises UploadRejected past ``max_size``."""
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                chunk = head or stream.read(_CHUNK_SIZE)
+                while chunk:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise UploadRejected(too_large_message(max_size))
+                    sha256.update(chunk)
+                    target.write(chunk)
+                    chunk = stream.read(_CHUNK_SIZE)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, sha256.hexdigest(), size
+
+    def adopt(self, tmp_path, digest):
+        """Move a finished temp file into place with an atomic rename, or drop
+        it when the same content is already stored."""
+        if self.exists(digest):
+            os.remove(tmp_path)
+        else:
+            target_path = self.path(digest)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(tmp_path, target_path)
+
+    def write(self, stream, head=b'', max_size=None):
+        """Store ``stream`` in one pass (see spool). Returns (digest, size)."""
+        tmp_path, digest, size = self.spool(stream, head, max_size)
+        try:
+            self.adopt(tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
+
+    def derived_path(self, digest, variant):
+        """Path of a file rendered from a blob (e.g. a preview), kept next to it."""
+        return f'{self.path(digest)}.{variant}'
+
+    def remove(self, digest):
+        paths = [self.path(digest), self._flat_path(digest)]
+        paths += glob.glob(glob.escape(self.path(digest)) + '.*')
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reshard(self, batch_size=500, rate=None):
+        """Move flat blob files into their shard directories. Yields the number
+        of files handled per batch; safe to interrupt and run again, since
+        only files still in the root are looked at."""
+        throttle = Throttle(rate)
+        handled = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file() or not DIGEST_RE.match(entry.name):
+                    continue
+                throttle.wait()
+                target_path = self.path(entry.name)
+                if os.path.exists(target_path):
+                    # Re-uploaded after sharding: the flat copy is redundant
+                    os.remove(entry.path)
+                else:
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    os.replace(entry.path, target_path)
+                handled += 1
+                if handled == batch_size:
+                    yield handled
+                    handled = 0
+        if handled:
+            yield handled
+
+
+def get_blob_store():
+    return current_app.extensions['blob_store']
+
+
+def blob_job_key(kind, blob):
+    # A digest can be deleted and uploaded again, within the same second too;
+    # the row's generation tells those apart so each gets its own job
+    if blob.generation:
+        return f'{kind}:{blob.digest}:{blob.generation}'
+    # Rows from before the generation column keep the keys they were queued with
+    created = blob.created_at.strftime('%Y%m%d%H%M%S') if blob.created_at else ''
+    return f'{kind}:{blob.digest}:{created}'
+
+
+def add_reference(digest, size, mime_type=None, original_size=None):
+    """Count one more letter pointing at ``digest``, creating its Blob row if needed.
+    Part of the caller's transaction; a new blob also queues its previews and
+    text extraction."""
+    blob = db.session.get(Blob, digest, with_for_update=True)
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = Blob(digest=digest, size=size, mime_type=mime_type, ref_count=1, original_size=original_size)
+                db.session.add(blob)
+            for kind in ('previews.render', 'text.extract'):
+                enqueue(kind, {'digest': digest}, key=blob_job_key(kind, blob))
+            return blob
+        except IntegrityError:
+            # Another request stored the same content first
+            blob = db.session.get(Blob, digest, with_for_update=True, populate_existing=True)
+    blob.ref_count += 1
+    return blob
+
+
+def release_reference(digest):
+    """Drop one reference to ``digest``; the last one deletes the blob and
+    queues the removal of its file, which a worker does after the commit."""
+    if not digest:
+        return
+    blob = db.session.get(Blob, digest, with_for_update=True)
+    if blob is None:
+        return
+    blob.ref_count -= 1
+    if blob.ref_count <= 0:
+        enqueue('blob.remove', {'digest': digest}, key=blob_job_key('blob.remove', blob))
+        db.session.delete(blob)
+
+
+def remove_legacy_file(legacy_folder, file_path):
+    """Queue the removal of a legacy uuid-named upload, as part of the
+    caller's transaction."""
+    if file_path:
+        enqueue('legacy.remove', {'folder': legacy_folder, 'file_path': file_path},
+                key=f'legacy.remove:{os.path.basename(legacy_folder)}:{file_path}')
+
+
+def _store_recompressed_jpeg(store, stream, head, max_size):
+    """Spool a JPEG upload, recompress it in the process pool and store the
+    result. Returns (digest, size, original size or None when kept as sent).
+
+    The upload may be up to JPEG_MAX_UPLOAD_SIZE; ``max_size`` applies to
+    what is stored. A failed or slow recompression keeps the upload as sent.
+    """
+    config = current_app.config
+    tmp_path, digest, size = store.spool(stream, head, config.get('JPEG_MAX_UPLOAD_SIZE', 16 * 1024 * 1024))
+    out_path = tmp_path + '.jpg'
+    future = None
+    try:
+        try:
+            future = _jpeg_pool.submit(
+                config.get('JPEG_OPTIMIZE_WORKERS', 2),
+                recompress_jpeg,
+                tmp_path,
+                out_path,
+                config.get('JPEG_QUALITY', 82),
+                config.get('JPEG_MAX_DIMENSION', 3508),
+            )
+            result = future.result(timeout=config.get('JPEG_OPTIMIZE_TIMEOUT', 60))
+        except Exception as e:
+            current_app.logger.warning(f'JPEG recompression failed, keeping the upload as sent: {e}')
+            result = None
+            if future is not None and not future.cancel():
+                # Still running after the timeout: it can write out_path long
+                # after the cleanup below, so remove that once it stops
+                future.add_done_callback(lambda _: _remove_quietly(out_path))
+        if result is None:
+            if max_size is not None and size > max_size:
+                raise UploadRejected(too_large_message(max_size))
+            store.adopt(tmp_path, digest)
+            return digest, size, None
+        new_digest, new_size, width, height = result
+        if max_size is not None and new_size > max_size:
+            raise UploadRejected(too_large_message(max_size))
+        store.adopt(out_path, new_digest)
+        if config.get('JPEG_KEEP_ORIGINAL'):
+            original_path = store.derived_path(new_digest, ORIGINAL)
+            if not os.path.exists(original_path):
+                os.makedirs(os.path.dirname(original_path), exist_ok=True)
+                os.replace(tmp_path, original_path)
+        current_app.logger.info(f'JPEG upload recompressed to {width}x{height}: {size} -> {new_size} bytes')
+        return new_digest, new_size, size
+    finally:
+        for path in (tmp_path, out_path):
+            _remove_quietly(path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def save_upload(stream, allowed_mime_types=ALLOWED_MIME_TYPES, max_size=MAX_UPLOAD_SIZE, recompress=True):
+    """Store an uploaded file and reference it. Returns the Blob.
+
+    The stream is read exactly once: the first chunk is sniffed, then every
+    chunk is counted, hashed and written. Raises UploadRejected on a
+    disallowed type (before anything is written) or when ``max_size`` is
+    exceeded. ``None`` disables either check.
+
+    With JPEG_OPTIMIZE on (and Pillow installed) JPEGs are recompressed
+    first, see _store_recompressed_jpeg; ``recompress=False`` skips that.
+    """
+    head = read_head(stream)
+    mime_type = sniff_mime(head)
+    if allowed_mime_types is not None and mime_type not in allowed_mime_types:
+        raise UploadRejected('Jenis file tidak diizinkan. Hanya PDF, DOCX, dan JPG yang diperbolehkan.')
+    store = get_blob_store()
+    if recompress and mime_type == JPEG_MIME and Image is not None and current_app.config.get('JPEG_OPTIMIZE'):
+        digest, size, original_size = _store_recompressed_jpeg(store, stream, head, max_size)
+        return add_reference(digest, size, mime_type, original_size=original_size)
+    digest, size = store.write(stream, head=head, max_size=max_size)
+    return add_reference(digest, size, mime_type)
+
+
+def discard_unreferenced(digest):
+    """Remove a stored file that never got a committed Blob row (e.g. a rejected
+    import row)."""
+    if db.session.get(Blob, digest) is None:
+        get_blob_store().remove(digest)
+
+
+def legacy_display_name(file_path):
+    """Original file name of a legacy uuid-prefixed upload."""
+    return LEGACY_NAME_RE.sub('', file_path)
+
+
+def migrate_legacy_files(model, legacy_folder, batch_size=200, dry_run=False, rate=None):
+    """Move the uuid-named files of ``model`` from ``legacy_folder`` into the
+    blob store, one committed batch at a time, at most ``rate`` files per
+    second. Rows already moved are skipped, so an interrupted run resumes
+    where it stopped. Returns a stats dict."""
+    stats = {'migrated': 0, 'deduplicated': 0, 'missing': []}
+    throttle = Throttle(rate)
+    last_id = 0
+    while True:
+        rows = (model.query.options(load_only(model.id, model.file_path, model.file_digest))
+                .filter(model.file_digest.is_(None), model.id > last_id)
+                .order_by(model.id).limit(batch_size).all())
+        if not rows:
+            break
+        moved = []
+        for surat in rows:
+            last_id = surat.id
+            path = os.path.join(legacy_folder, surat.file_path)
+            if not os.path.isfile(path):
+                stats['missing'].append((surat.id, surat.file_path))
+                continue
+            if dry_run:
+                moved.append(path)
+                continue
+            throttle.wait()
+            with open(path, 'rb') as legacy_file:
+                # Keep whatever was accepted back then
+                blob = save_upload(legacy_file, allowed_mime_types=None, max_size=None, recompress=False)
+            if blob.ref_count > 1:
+                stats['deduplicated'] += 1
+            surat.file_digest = blob.digest
+            surat.file_path = legacy_display_name(surat.file_path) or blob.digest
+            moved.append(path)
+        if not dry_run:
+            db.session.commit()
+            # Old copies are only removed once the rows point at their blobs
+            for path in moved:
+                os.remove(path)
+        stats['migrated'] += len(moved)
+    return stats
+
+
+@job_handler('blob.remove')
+def _remove_blob_file(digest):
+    # Queued with the delete, so a rollback never leaves a Blob row without
+    # its content; skipped when the same content was uploaded again meanwhile
+    if db.session.get(Blob, digest) is None:
+        get_blob_store().remove(digest)
+
+
+@job_handler('legacy.remove')
+def _remove_legacy_file(folder, file_path):
+    path = safe_join(folder, file_path)
+    if path and os.path.isfile(path):
+        os.remove(path)
+
+
+def init_storage(app):
+    root = os.path.join(os.getcwd(), app.config.get('UPLOAD_FOLDER', 'app/uploads'), 'blobs')
+    app.extensions['blob_store'] = BlobStore(root)
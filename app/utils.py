@@ -1,3 +1,93 @@
 # File ini dapat digunakan untuk fungsi utilitas di masa depan.
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 
+class Throttle:
+    """Spaces successive wait() calls to at most ``rate`` per second.
+    A rate of None or 0 never waits."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+class ProcessPool:
+    """Process pool started on first use, replaced once if a worker died
+    (e.g. killed for memory). Functions submitted to it must be importable,
+    module-level ones."""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, workers, fn, *args):
+        for attempt in range(2):
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a threaded server process can copy held locks
+                    self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+                executor = self._executor
+            try:
+                return executor.submit(fn, *args)
+            except BrokenProcessPool:
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+        raise BrokenProcessPool('process pool keeps failing')
+
+
+class LocalSQLite:
+    """A SQLite file in WAL mode shared by the processes on this host: one
+    connection per thread, reopened after a fork (gunicorn --preload).
+    Connections are in autocommit mode; use write() for a transaction."""
+
+    def __init__(self, uri, schema=(), timeout=5.0):
+        # Same convention as SQLAlchemy: three slashes relative, four absolute
+        self.path = uri.split('://', 1)[1][1:]
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        for statement in schema:
+            connection.execute(statement)
+
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextmanager
+    def write(self):
+        """BEGIN IMMEDIATE ... COMMIT: takes the write lock up front, so a
+        read-modify-write inside is atomic across processes."""
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
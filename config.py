@@ -1,4 +1,5 @@
 import os
+import tempfile
 import urllib.parse
 
 class Config:
@@ -56,6 +57,112 @@ class Config:
 
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
 
+    # Full-text search engine for the letter lists: 'auto' (MySQL FULLTEXT /
+    # SQLite FTS5, falling back to an in-memory index), 'mysql', 'sqlite',
+    # 'python' or 'like' (legacy substring search)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+
+    # Cached list totals per filter signature (entries, seconds)
+    COUNT_CACHE_SIZE = int(os.environ.get('COUNT_CACHE_SIZE', 512))
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 300))
+    # Per-process cache of the logged-in user. USER_CACHE_STORE is a SQLite
+    # file counting changes per user, shared by the workers of one host, so a
+    # change made in any of them applies at once; other hosts catch up within
+    # USER_CACHE_TTL seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+    USER_CACHE_STORE = (os.environ.get('USER_CACHE_STORE')
+                        or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'mapascal-cache.db'))
+    # Member roster pages (see app.cache.DirectoryCache) and page size
+    DIRECTORY_CACHE_SIZE = int(os.environ.get('DIRECTORY_CACHE_SIZE', 128))
+    DIRECTORY_CACHE_TTL = int(os.environ.get('DIRECTORY_CACHE_TTL', 300))
+    ROSTER_PER_PAGE = int(os.environ.get('ROSTER_PER_PAGE', 50))
+
+    # Who sends letter files after the auth checks: 'none' (the app, through
+    # the server's sendfile-capable file wrapper), 'x-accel' (nginx
+    # X-Accel-Redirect) or 'x-sendfile' (Apache/lighttpd X-Sendfile)
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', 'none')
+    # Internal nginx location aliased to UPLOAD_FOLDER, used by 'x-accel'
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+
+    # Rate limit counters. A SQLite file (see app.ratelimit) is shared by the
+    # gunicorn workers of ONE host only; the default lives in the system temp
+    # directory, outside the code tree. Point it at persistent storage to keep
+    # counters across restarts, e.g. 'sqlite:////var/lib/mapascal/ratelimit.db'.
+    # With several hosts or containers use redis://...; 'memory://' keeps
+    # counters per worker.
+    RATELIMIT_STORAGE_URI = (os.environ.get('RATELIMIT_STORAGE_URI')
+                             or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'mapascal-ratelimit.db'))
+    RATELIMIT_STRATEGY = os.environ.get('RATELIMIT_STRATEGY', 'sliding-window-counter')
+
+    # Lifetime in seconds of the access codes issued by bulk approval. A code
+    # sheet is printed or forwarded, so keep this short: a day at most
+    BULK_ACCESS_TOKEN_EXPIRES = int(os.environ.get('BULK_ACCESS_TOKEN_EXPIRES', 24 * 3600))
+
+    # Password hashing, as a Werkzeug method string: 'scrypt:N:r:p' or
+    # 'pbkdf2:sha256:iterations'. Existing hashes are upgraded on the next
+    # successful login. Compare settings with `flask password-benchmark`.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+    # Background jobs remove replaced files and render previews/text, all
+    # under UPLOAD_FOLDER, so they run in a `flask jobs-worker` process on the
+    # same host or volume as the web server (jobs queued on another volume
+    # fail instead of running). With no worker at all, old files are never
+    # removed and previews/search text never appear. JOBS_IN_PROCESS=True
+    # instead runs one job thread inside each web process (small single-host
+    # setups); the pool gets a connection more for it.
+    JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', 'False').lower() in ('true', '1', 'yes')
+    if JOBS_IN_PROCESS:
+        SQLALCHEMY_ENGINE_OPTIONS = dict(SQLALCHEMY_ENGINE_OPTIONS, pool_size=SQLALCHEMY_ENGINE_OPTIONS['pool_size'] + 1)
+    # Worker threads, tries per job,
+    # retry backoff base and cap in seconds, and after how many seconds a
+    # running job of a vanished worker is handed out again
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_BASE = int(os.environ.get('JOB_RETRY_BASE', 30))
+    JOB_RETRY_MAX = int(os.environ.get('JOB_RETRY_MAX', 3600))
+    JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 600))
+
+    # Preview rendering after upload: worker processes (0 disables it) and the
+    # bounding box in pixels of thumbnails and previews. PDF previews need the
+    # pdftoppm binary (poppler-utils) where the jobs run; without it their
+    # jobs fail and show up in /admin/jobs
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+    PREVIEW_THUMB_SIZE = int(os.environ.get('PREVIEW_THUMB_SIZE', 240))
+    PREVIEW_SIZE = int(os.environ.get('PREVIEW_SIZE', 1024))
+
+    # Optional JPEG recompression on upload (needs Pillow): strips EXIF, fits
+    # the image in JPEG_MAX_DIMENSION pixels at JPEG_QUALITY. Uploads may be
+    # up to JPEG_MAX_UPLOAD_SIZE as long as the result fits the 5 MB limit.
+    JPEG_OPTIMIZE = os.environ.get('JPEG_OPTIMIZE') == 'True'
+    JPEG_QUALITY = int(os.environ.get('JPEG_QUALITY', 82))
+    JPEG_MAX_DIMENSION = int(os.environ.get('JPEG_MAX_DIMENSION', 3508)) # A4 at 300 dpi
+    JPEG_KEEP_ORIGINAL = os.environ.get('JPEG_KEEP_ORIGINAL') == 'True'
+    JPEG_MAX_UPLOAD_SIZE = int(os.environ.get('JPEG_MAX_UPLOAD_SIZE', 16 * 1024 * 1024))
+    JPEG_OPTIMIZE_WORKERS = int(os.environ.get('JPEG_OPTIMIZE_WORKERS', 2))
+    JPEG_OPTIMIZE_TIMEOUT = int(os.environ.get('JPEG_OPTIMIZE_TIMEOUT', 60))
+
+    # Text extraction for content search: worker processes (0 extracts in the
+    # calling thread), pages read per PDF, characters kept per file
+    TEXT_EXTRACT_WORKERS = int(os.environ.get('TEXT_EXTRACT_WORKERS', 2))
+    TEXT_EXTRACT_MAX_PAGES = int(os.environ.get('TEXT_EXTRACT_MAX_PAGES', 200))
+    TEXT_EXTRACT_MAX_CHARS = int(os.environ.get('TEXT_EXTRACT_MAX_CHARS', 1000000))
+
+    # Bulk import: threads that sniff and extract scans, rows per executemany
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 4))
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+
+    # Report the number of SQL statements per request in an X-Query-Count header
+    QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER') == 'True'
+
+    # Where session data lives: Flask's signed cookie sessions ('cookie', the
+    # default), or a SQLite file shared by the workers of one host, the cookie
+    # holding only an opaque id (see app.sessions). Give that file an absolute
+    # path on persistent storage outside the code tree, e.g.
+    # 'sqlite:////var/lib/mapascal/sessions.db': a file inside the deploy is
+    # lost on every redeploy, logging everyone out, and is not shared between
+    # hosts or containers
+    SESSION_STORE = os.environ.get('SESSION_STORE') or 'cookie'
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
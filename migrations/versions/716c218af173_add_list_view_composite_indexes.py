@@ -0,0 +1,55 @@
+"""Add composite indexes for the surat_masuk and surat_keluar list views
+
+Revision ID: 716c218af173
+Revises: c5368fbacf05
+Create Date: 2026-10-18 08:02:47.530912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '716c218af173'
+down_revision = 'c5368fbacf05'
+branch_labels = None
+depends_on = None
+
+# Every list is ordered by (sort column, id) for keyset pagination, and the
+# anggota view is additionally filtered by uploaded_by_user_id. perihal is a
+# TEXT column and cannot back an ORDER BY index, so it is left out.
+INDEXES = {
+    'surat_masuk': {
+        'ix_surat_masuk_owner_tanggal_terima': ['uploaded_by_user_id', 'tanggal_terima', 'id'],
+        'ix_surat_masuk_owner_asal_surat': ['uploaded_by_user_id', 'asal_surat', 'id'],
+        'ix_surat_masuk_owner_nomor_surat': ['uploaded_by_user_id', 'nomor_surat', 'id'],
+        'ix_surat_masuk_tanggal_terima': ['tanggal_terima', 'id'],
+        'ix_surat_masuk_asal_surat': ['asal_surat', 'id'],
+    },
+    'surat_keluar': {
+        'ix_surat_keluar_owner_tanggal_surat': ['uploaded_by_user_id', 'tanggal_surat', 'id'],
+        'ix_surat_keluar_owner_tujuan_surat': ['uploaded_by_user_id', 'tujuan_surat', 'id'],
+        'ix_surat_keluar_owner_nomor_surat': ['uploaded_by_user_id', 'nomor_surat', 'id'],
+        'ix_surat_keluar_tanggal_surat': ['tanggal_surat', 'id'],
+        'ix_surat_keluar_tujuan_surat': ['tujuan_surat', 'id'],
+    },
+}
+
+
+def upgrade():
+    for table, indexes in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name, columns in indexes.items():
+                batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    is_mysql = op.get_bind().dialect.name == 'mysql'
+    for table, indexes in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            if is_mysql:
+                # InnoDB drops the implicit foreign key index once the owner_*
+                # indexes cover uploaded_by_user_id, so put one back first
+                batch_op.create_index(f'ix_{table}_uploaded_by_user_id', ['uploaded_by_user_id'], unique=False)
+            for name in indexes:
+                batch_op.drop_index(name)
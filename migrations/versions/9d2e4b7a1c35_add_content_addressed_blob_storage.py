@@ -0,0 +1,44 @@
+"""Add content-addressed blob storage for letter files
+
+Revision ID: 9d2e4b7a1c35
+Revises: 716c218af173
+Create Date: 2026-10-18 08:41:09.274113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e4b7a1c35'
+down_revision = '716c218af173'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('mime_type', sa.String(length=100), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    # Existing files stay where they are until `flask storage-migrate` moves them
+    for table in ('surat_masuk', 'surat_keluar'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('file_digest', sa.String(length=64), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table}_file_digest'), ['file_digest'], unique=False)
+            batch_op.create_foreign_key(f'fk_{table}_file_digest_blobs', 'blobs', ['file_digest'], ['digest'])
+
+
+def downgrade():
+    # Rows already moved into the blob store lose their file link; only
+    # downgrade before running `flask storage-migrate`
+    for table in ('surat_masuk', 'surat_keluar'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(f'fk_{table}_file_digest_blobs', type_='foreignkey')
+            batch_op.drop_index(batch_op.f(f'ix_{table}_file_digest'))
+            batch_op.drop_column('file_digest')
+    op.drop_table('blobs')
@@ -0,0 +1,27 @@
+"""Give every blob row a generation for its job keys
+
+Revision ID: a93f5d2e7c18
+Revises: e2ce4084b69e
+Create Date: 2026-10-18 16:42:07.215930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93f5d2e7c18'
+down_revision = 'e2ce4084b69e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows stay NULL and keep their created_at based job keys
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('generation', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.drop_column('generation')
@@ -0,0 +1,46 @@
+"""Add extracted document text for content search
+
+Revision ID: b71e3c9a4d08
+Revises: 3f8a1d6c2b94
+Create Date: 2026-10-18 11:03:26.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e3c9a4d08'
+down_revision = '3f8a1d6c2b94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by the text.extract job for new uploads and `flask text-extract`
+    # for existing ones
+    op.create_table('blob_texts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('extractor_version', sa.Integer(), nullable=False),
+    sa.Column('char_count', sa.Integer(), nullable=False),
+    sa.Column('content', sa.LargeBinary().with_variant(mysql.MEDIUMBLOB(), 'mysql'), nullable=True),
+    sa.Column('search_text', sa.Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'), nullable=True),
+    sa.Column('extracted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['digest'], ['blobs.digest'], name='fk_blob_texts_digest_blobs'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('digest', name='uq_blob_texts_digest')
+    )
+    # SQLite builds its FTS5 table on first use (see app/search.py)
+    if op.get_bind().dialect.name == 'mysql':
+        op.create_index('ft_blob_texts_search_text', 'blob_texts', ['search_text'], mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.drop_index('ft_blob_texts_search_text', table_name='blob_texts')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS blob_texts_fts')
+    op.drop_table('blob_texts')
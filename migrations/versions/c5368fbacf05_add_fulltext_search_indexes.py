@@ -0,0 +1,50 @@
+"""Add FULLTEXT search indexes for surat_masuk and surat_keluar
+
+Revision ID: c5368fbacf05
+Revises: 06a2f743db97
+Create Date: 2026-10-18 07:40:12.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5368fbacf05'
+down_revision = '06a2f743db97'
+branch_labels = None
+depends_on = None
+
+# MATCH() only uses a FULLTEXT index whose column list is identical, so every
+# search_by option (and the combined "semua" search) gets its own index.
+FULLTEXT_INDEXES = {
+    'surat_masuk': {
+        'ft_surat_masuk_nomor_surat': ['nomor_surat'],
+        'ft_surat_masuk_asal_surat': ['asal_surat'],
+        'ft_surat_masuk_perihal': ['perihal'],
+        'ft_surat_masuk_semua': ['nomor_surat', 'asal_surat', 'perihal'],
+    },
+    'surat_keluar': {
+        'ft_surat_keluar_nomor_surat': ['nomor_surat'],
+        'ft_surat_keluar_tujuan_surat': ['tujuan_surat'],
+        'ft_surat_keluar_perihal': ['perihal'],
+        'ft_surat_keluar_semua': ['nomor_surat', 'tujuan_surat', 'perihal'],
+    },
+}
+
+
+def upgrade():
+    # SQLite builds its FTS5 tables on first use (see app/search.py)
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    for table, indexes in FULLTEXT_INDEXES.items():
+        for name, columns in indexes.items():
+            op.create_index(name, table, columns, mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    for table, indexes in FULLTEXT_INDEXES.items():
+        for name in indexes:
+            op.drop_index(name, table_name=table)
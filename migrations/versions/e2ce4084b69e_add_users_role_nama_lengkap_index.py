@@ -0,0 +1,27 @@
+"""Add a (role, nama_lengkap, id) index for the member roster
+
+Revision ID: e2ce4084b69e
+Revises: e4c09a7b5f21
+Create Date: 2026-10-18 14:05:12.408113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2ce4084b69e'
+down_revision = 'e4c09a7b5f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The roster filters on role and seeks on (nama_lengkap, id)
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_role_nama_lengkap', ['role', 'nama_lengkap', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_role_nama_lengkap')
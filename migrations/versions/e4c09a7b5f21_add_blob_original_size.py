@@ -0,0 +1,26 @@
+"""Record the upload size of recompressed JPEG blobs
+
+Revision ID: e4c09a7b5f21
+Revises: b71e3c9a4d08
+Create Date: 2026-10-18 12:20:51.337904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4c09a7b5f21'
+down_revision = 'b71e3c9a4d08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('original_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.drop_column('original_size')